@@ -0,0 +1,287 @@
+import asyncio
+import os
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlparse
+
+from codec import loads
+
+BACKPLANE_URL = os.environ.get("BACKPLANE_URL")  # redis://host:6379/0 or unix:///path/to/socket
+BACKPLANE_CHANNEL = os.environ.get("BACKPLANE_CHANNEL", "shadowchat:events")
+BACKPLANE_BACKLOG = int(os.environ.get("BACKPLANE_BACKLOG", 10000))  # events held while the broker is unreachable
+
+Handler = Callable[[str, dict, bytes], Awaitable[None]]  # (node_id, event, encoded event)
+
+
+class BackplaneError(Exception):
+    pass
+
+
+# RESP (Redis serialization protocol) helpers, shared with broker.py
+
+def encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Backplane connection closed")
+
+    prefix, rest = line[:1], line[1:-2]
+    if prefix == b"+":
+        return rest.decode()
+    if prefix == b"-":
+        raise BackplaneError(rest.decode())
+    if prefix == b":":
+        return int(rest)
+    if prefix == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise BackplaneError(f"Unexpected reply: {line!r}")
+
+
+class Backplane:
+    """Cross-node event bus.
+
+    Every node publishes each event once; every node (including the one that
+    published it) receives it through the handler and delivers it to its own
+    local sockets.
+
+    Events travel with their JSON encoding (`frame`), made once by the
+    publisher; nodes decode it to apply the event and forward the same bytes
+    to their sockets. `publish_to` sends an event to one node only, for
+    replies nobody else needs to decode.
+    """
+
+    def __init__(self):
+        self.node_id = str(uuid.uuid4())
+        self.handler: Optional[Handler] = None
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, handler: Handler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, event: dict, frame: bytes):
+        raise NotImplementedError
+
+    async def publish_to(self, node_id: str, event: dict, frame: bytes):
+        raise NotImplementedError
+
+    async def _dispatch(self, node_id: str, event: dict, frame: bytes):
+        self.received += 1
+        if self.handler is not None:
+            await self.handler(node_id, event, frame)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "node_id": self.node_id,
+            "published": self.published,
+            "received": self.received,
+        }
+
+
+class LocalBackplane(Backplane):
+    """Single-process backplane: publishing is a direct call to the handler."""
+
+    async def publish(self, event: dict, frame: bytes):
+        self.published += 1
+        await self._dispatch(self.node_id, event, frame)
+
+    async def publish_to(self, node_id: str, event: dict, frame: bytes):
+        if node_id == self.node_id:
+            await self.publish(event, frame)
+
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis PUBLISH/SUBSCRIBE, spoken directly as RESP.
+
+    Works against a real Redis or the stand-in in broker.py. Publishes are
+    pipelined on one connection; a second connection holds the subscriptions
+    (the shared channel and this node's own "<channel>:<node_id>") and
+    reconnects with backoff if it drops.
+
+    The publisher has already applied an event by the time it is published,
+    so a publish never fails: while the broker is unreachable events wait in
+    a bounded backlog, in order, and are sent once it is back. Only events
+    pushed out of a full backlog are lost.
+    """
+
+    def __init__(self, url: str, channel: str = BACKPLANE_CHANNEL, backlog: int = BACKPLANE_BACKLOG):
+        super().__init__()
+        parsed = urlparse(url)
+        self.channel = channel
+        self.direct_channel = f"{channel}:{self.node_id}"
+        self.path = parsed.path if parsed.scheme == "unix" else None
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.publisher: Optional[asyncio.StreamWriter] = None
+        self.publish_lock = asyncio.Lock()
+        self.tasks = []
+        self.errors = 0
+        self.subscribed = asyncio.Event()
+        self.backlog = deque(maxlen=backlog)  # PUBLISH commands waiting for the broker
+        self.backlog_task: Optional[asyncio.Task] = None
+        self.lost = 0
+
+    async def _connect(self):
+        if self.path:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(encode_command("AUTH", self.password))
+            await read_reply(reader)
+        return reader, writer
+
+    async def start(self):
+        self.tasks.append(asyncio.create_task(self._listen()))
+        await asyncio.wait_for(self.subscribed.wait(), 10)
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+
+    async def _ensure_publisher(self) -> asyncio.StreamWriter:
+        if self.publisher is None or self.publisher.is_closing():
+            reader, writer = await self._connect()
+            self.publisher = writer
+            self.tasks.append(asyncio.create_task(self._drain_replies(reader, writer)))
+        return self.publisher
+
+    async def _drain_replies(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                await read_reply(reader)
+        except BackplaneError:
+            self.errors += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        if self.publisher is writer:
+            self.publisher = None
+        writer.close()
+
+    async def publish(self, event: dict, frame: bytes):
+        await self._publish(self.channel, frame)
+
+    async def publish_to(self, node_id: str, event: dict, frame: bytes):
+        await self._publish(f"{self.channel}:{node_id}", frame)
+
+    async def _publish(self, channel: str, frame: bytes):
+        # "<node_id>\n<event JSON>", so the event bytes are never re-encoded
+        data = b"%s\n%s" % (self.node_id.encode(), frame)
+        command = encode_command("PUBLISH", channel, data)
+        self.published += 1
+        if self.backlog:
+            self._hold(command)  # behind the events already waiting
+            return
+        async with self.publish_lock:
+            try:
+                writer = await self._ensure_publisher()
+                writer.write(command)
+                await writer.drain()
+            except (ConnectionError, OSError):
+                self.errors += 1
+                self.publisher = None
+                self._hold(command)
+
+    def _hold(self, command: bytes):
+        if len(self.backlog) == self.backlog.maxlen:
+            self.lost += 1
+        self.backlog.append(command)
+        if self.backlog_task is None or self.backlog_task.done():
+            self.backlog_task = asyncio.create_task(self._send_backlog())
+            self.tasks.append(self.backlog_task)
+
+    async def _send_backlog(self):
+        delay = 0.1
+        while self.backlog:
+            # Wait for our own subscription to come back, so this node (and
+            # peers reconnecting at the same pace) hears the events it sends
+            await self.subscribed.wait()
+            async with self.publish_lock:
+                try:
+                    writer = await self._ensure_publisher()
+                    while self.backlog:
+                        writer.write(self.backlog[0])
+                        await writer.drain()
+                        self.backlog.popleft()
+                    return
+                except (ConnectionError, OSError):
+                    self.errors += 1
+                    self.publisher = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+    async def _listen(self):
+        delay = 0.1
+        while True:
+            try:
+                reader, writer = await self._connect()
+                writer.write(encode_command("SUBSCRIBE", self.channel, self.direct_channel))
+                await writer.drain()
+                delay = 0.1
+
+                while True:
+                    reply = await read_reply(reader)
+                    if not isinstance(reply, list) or not reply:
+                        continue
+                    kind = reply[0]
+                    if kind == b"subscribe" and reply[2] == 2:
+                        self.subscribed.set()
+                    elif kind == b"message":
+                        node_id, _, frame = reply[2].partition(b"\n")
+                        try:
+                            await self._dispatch(node_id.decode(), loads(frame), frame)
+                        except Exception as e:
+                            self.errors += 1
+                            print(f"Backplane handler failed: {e!r}")
+            except asyncio.CancelledError:
+                raise
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, BackplaneError):
+                self.errors += 1
+                self.subscribed.clear()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["errors"] = self.errors
+        stats["subscribed"] = self.subscribed.is_set()
+        stats["backlog"] = len(self.backlog)
+        stats["lost"] = self.lost
+        return stats
+
+
+def create_backplane(url: Optional[str] = BACKPLANE_URL) -> Backplane:
+    if not url:
+        return LocalBackplane()
+    return RedisBackplane(url)
@@ -0,0 +1,118 @@
+"""Build a synthetic SQLite history and check the history and membership
+queries in queries.py against it.
+
+    python bench_history.py --messages 2000000 --path /tmp/history.db
+
+Prints the query plan and timing of each query and exits non-zero if any
+plan scans a table or sorts with a temporary B-tree.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+
+from database import Base, Group, GroupMember, Message, User
+from queries import (cursor_statement, history_statement, membership_statement,
+                     user_groups_statement)
+
+BATCH = 50000
+
+
+def populate(engine, messages: int, groups: int, users: int, seed: int):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    user_ids = [f"user-{i}" for i in range(users)]
+    group_ids = [f"group-{i}" for i in range(groups)]
+    chat_ids = [f"user-{i}_user-{i + 1}" for i in range(0, users - 1, 2)]
+
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": u, "username": u, "connected_at": start, "last_seen": start}
+                                    for u in user_ids])
+        conn.execute(insert(Group), [{"id": g, "name": g, "type": "public", "creator_id": user_ids[0],
+                                      "created_at": start, "last_activity": start} for g in group_ids])
+        members = {(g, u) for g in group_ids for u in rng.sample(user_ids, min(users, 50))}
+        conn.execute(insert(GroupMember), [{"group_id": g, "user_id": u, "joined_at": start}
+                                           for g, u in members])
+
+    written = 0
+    while written < messages:
+        rows = []
+        for i in range(written, min(messages, written + BATCH)):
+            private = rng.random() < 0.3
+            rows.append({
+                "id": f"msg-{i:09d}",
+                "sender_id": rng.choice(user_ids),
+                "content": "x" * rng.randint(10, 120),
+                "timestamp": start + timedelta(milliseconds=i * 50),
+                "message_type": "text",
+                "group_id": None if private else rng.choice(group_ids),
+                "private_chat_id": rng.choice(chat_ids) if private else None,
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(Message), rows)
+        written += len(rows)
+        print(f"\r{written}/{messages} messages", end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+
+def explain(conn, statement) -> list:
+    compiled = statement.compile(conn.engine)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    params = tuple(p.isoformat(" ") if isinstance(p, datetime) else p for p in params)
+    return [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params)]
+
+
+def timed(conn, statement, repeat: int = 200) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(statement).all()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--path", default="history_bench.db")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reuse", action="store_true", help="keep an existing database file")
+    args = parser.parse_args()
+
+    if not args.reuse and os.path.exists(args.path):
+        os.remove(args.path)
+    engine = create_engine(f"sqlite:///{args.path}")
+    if not args.reuse:
+        Base.metadata.create_all(engine)
+        populate(engine, args.messages, args.groups, args.users, args.seed)
+
+    middle = (datetime(2024, 1, 1) + timedelta(milliseconds=args.messages * 25), "msg-000000000")
+    cases = {
+        "latest page (group)": history_statement(Message.group_id, "group-7", limit=100),
+        "page before cursor (group)": history_statement(Message.group_id, "group-7", before=middle, limit=100),
+        "page after cursor (group)": history_statement(Message.group_id, "group-7", after=middle, limit=100),
+        "page before timestamp (private)": history_statement(Message.private_chat_id, "user-2_user-3",
+                                                             before=(middle[0], None), limit=50),
+        "cursor lookup": cursor_statement(Message.group_id, "group-7", "msg-000000123"),
+        "membership check": membership_statement("group-7", "user-3"),
+        "groups of user": user_groups_statement("user-3"),
+    }
+
+    failed = False
+    with engine.connect() as conn:
+        for name, statement in cases.items():
+            plan = explain(conn, statement)
+            bad = [step for step in plan if step.startswith("SCAN") or "TEMP B-TREE" in step]
+            failed = failed or bool(bad)
+            print(f"{name}: {timed(conn, statement):.3f} ms{'  <-- SCAN' if bad else ''}")
+            for step in plan:
+                print(f"    {step}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
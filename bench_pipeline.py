@@ -0,0 +1,81 @@
+"""Micro-benchmark of the per-message send path on one core.
+
+    python bench_pipeline.py --members 50 --seconds 3
+
+Compares the original path (datetime formatting and json.dumps per
+recipient) with the current one (cached timestamps, one encode per event
+shared by every recipient and the backplane, slot records in history).
+Sockets are replaced by in-memory queues so only CPU work is measured.
+"""
+import argparse
+import json
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import codec
+from history import HistoryStore, MessageRecord
+
+
+def original(sender_id: str, group_id: str, members: list, sinks: list, store: dict):
+    message = {
+        "id": str(uuid.uuid4()),
+        "sender_id": sender_id,
+        "sender_username": "alice",
+        "content": "hello there, how is everyone doing today?",
+        "timestamp": datetime.utcnow().isoformat(),
+        "message_type": "text",
+    }
+    store.setdefault(group_id, []).append(message)
+    payload = {"type": "group_message", "group_id": group_id, "message": message}
+    for sink in sinks:
+        sink.append(json.dumps(payload))
+
+
+def pipeline(sender_id: str, group_id: str, members: list, sinks: list, store: HistoryStore):
+    message = {
+        "id": str(uuid.uuid4()),
+        "sender_id": sender_id,
+        "sender_username": "alice",
+        "content": "hello there, how is everyone doing today?",
+        "timestamp": codec.utc_timestamp(),
+        "message_type": "text",
+    }
+    event = {"type": "group_message", "group_id": group_id, "message": message}
+    frame = codec.dumps(event)
+    store.append(group_id, MessageRecord.from_dict(message))
+    text = frame.decode()
+    for sink in sinks:
+        sink.append(text)
+
+
+def run(step, store, members: int, seconds: float) -> float:
+    member_ids = [str(uuid.uuid4()) for _ in range(members)]
+    sinks = [deque(maxlen=256) for _ in range(members)]
+    group_id = str(uuid.uuid4())
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            step(member_ids[0], group_id, member_ids, sinks, store)
+        count += 100
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--members", type=int, default=50, help="recipients per message")
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    before = run(original, {}, args.members, args.seconds)
+    after = run(pipeline, HistoryStore(), args.members, args.seconds)
+    print(f"JSON backend: {codec.backend}, {args.members} recipients per message")
+    print(f"original: {before:10.0f} msgs/sec/core")
+    print(f"pipeline: {after:10.0f} msgs/sec/core  ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
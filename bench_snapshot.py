@@ -0,0 +1,104 @@
+"""Write a synthetic state journal and time restoring main.py's state from it.
+
+    python bench_snapshot.py --messages 100000 --path /tmp/shadowchat.journal
+
+Half of the messages go into the compacted snapshot record and half into
+the event log after it, so both restore paths are measured. Exits non-zero
+if the restore takes longer than --budget seconds.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from codec import dumps
+from journal import LENGTH, MAGIC, Journal
+
+
+def message(rng: random.Random, n: int, sender: str, when: datetime) -> dict:
+    return {
+        "id": f"m{n}",
+        "sender_id": sender,
+        "sender_username": sender,
+        "content": "x" * rng.randint(10, 200),
+        "timestamp": when.isoformat(timespec="microseconds"),
+        "message_type": "text",
+    }
+
+
+def build(messages: int, users: int, groups: int, seed: int) -> list:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    user_ids = [f"user{i}" for i in range(users)]
+    group_ids = [f"group{i}" for i in range(groups)]
+    members = {g: sorted(rng.sample(user_ids, min(users, 50))) for g in group_ids}
+    chats = [f"chat_{user_ids[i]}_{user_ids[i + 1]}" for i in range(0, users - 1, 2)]
+
+    state = {
+        "users": [{"id": u, "username": u, "connected_at": start.isoformat(), "last_seen": start.isoformat()}
+                  for u in user_ids],
+        "groups": [{"id": g, "name": g, "description": "", "type": "public", "password_hash": None,
+                    "creator_id": members[g][0], "created_at": start.isoformat(),
+                    "last_activity": start.isoformat()} for g in group_ids],
+        "members": members,
+        "presence": {},
+        "messages": {g: [] for g in group_ids},
+        "private_chats": {c: [] for c in chats},
+        "inboxes": {},
+    }
+    events = []
+    for n in range(messages):
+        when = start + timedelta(seconds=n)
+        if rng.random() < 0.5:
+            group_id = rng.choice(group_ids)
+            record = message(rng, n, rng.choice(members[group_id]), when)
+            event = {"type": "group_message", "group_id": group_id, "message": record}
+            target = state["messages"][group_id]
+        else:
+            chat_id = rng.choice(chats)
+            sender, recipient = chat_id[len("chat_"):].split("_")
+            record = message(rng, n, sender, when)
+            event = {"type": "private_message", "chat_id": chat_id, "recipient_id": recipient, "message": record}
+            target = state["private_chats"][chat_id]
+        if n < messages // 2:
+            target.append(record)
+        else:
+            events.append(event)
+    return [{"type": "state_snapshot", "state": state}] + events
+
+
+def write(path: str, records: list) -> int:
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        for record in records:
+            payload = dumps(record)
+            f.write(LENGTH.pack(len(payload)) + payload)
+        return f.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--path", default="/tmp/shadowchat.journal")
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds the restore may take")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    size = write(args.path, build(args.messages, args.users, args.groups, args.seed))
+    print(f"journal: {args.path}, {size / 1e6:.1f} MB")
+
+    import main as server
+    server.journal = Journal(args.path)
+
+    start = time.perf_counter()
+    server.restore_journal()
+    elapsed = time.perf_counter() - start
+    print(f"restore: {elapsed * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms)")
+    sys.exit(0 if elapsed <= args.budget else 1)
+
+
+if __name__ == "__main__":
+    main()
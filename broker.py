@@ -0,0 +1,114 @@
+"""Minimal Redis-protocol pub/sub broker.
+
+Implements just enough of RESP (PING, SUBSCRIBE, UNSUBSCRIBE, PUBLISH) to
+stand in for Redis when running several nodes locally:
+
+    python broker.py --port 6380
+    BACKPLANE_URL=redis://localhost:6380 uvicorn main:app --port 8001
+
+`python main.py` with WORKERS > 1 starts one on a Unix socket for its workers.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from typing import Dict, Set
+
+from backplane import encode_command, read_reply
+
+BROKER_SOCKET = os.environ.get("BROKER_SOCKET", "/tmp/shadowchat-broker.sock")
+
+subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+
+
+def _reply(writer: asyncio.StreamWriter, *items):
+    writer.write(b"*%d\r\n" % len(items) + b"".join(
+        b":%d\r\n" % item if isinstance(item, int) else b"$%d\r\n%s\r\n" % (len(item), item)
+        for item in items
+    ))
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    channels: Set[bytes] = set()
+    try:
+        while True:
+            command = await read_reply(reader)
+            if not isinstance(command, list) or not command:
+                continue
+            name = command[0].upper()
+
+            if name == b"PING":
+                writer.write(b"+PONG\r\n")
+            elif name == b"AUTH":
+                writer.write(b"+OK\r\n")
+            elif name == b"SUBSCRIBE":
+                for channel in command[1:]:
+                    subscribers.setdefault(channel, set()).add(writer)
+                    channels.add(channel)
+                    _reply(writer, b"subscribe", channel, len(channels))
+            elif name == b"UNSUBSCRIBE":
+                for channel in command[1:] or list(channels):
+                    subscribers.get(channel, set()).discard(writer)
+                    channels.discard(channel)
+                    _reply(writer, b"unsubscribe", channel, len(channels))
+            elif name == b"PUBLISH":
+                channel, data = command[1], command[2]
+                targets = subscribers.get(channel, ())
+                frame = encode_command("message", channel, data)
+                for target in targets:
+                    target.write(frame)
+                writer.write(b":%d\r\n" % len(targets))
+            elif name == b"QUIT":
+                writer.write(b"+OK\r\n")
+                break
+            else:
+                writer.write(b"-ERR unknown command '%s'\r\n" % name)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        for channel in channels:
+            subscribers.get(channel, set()).discard(writer)
+        writer.close()
+
+
+async def serve(host: str, port: int, unix_path: str = None):
+    if unix_path:
+        server = await asyncio.start_unix_server(handle_client, path=unix_path)
+        print(f"Broker listening on unix:{unix_path}")
+    else:
+        server = await asyncio.start_server(handle_client, host, port)
+        print(f"Broker listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def _run_unix(path: str):
+    asyncio.run(serve("", 0, path))
+
+
+def start_local_broker(path: str = BROKER_SOCKET, timeout: float = 5) -> str:
+    """Run a broker on a Unix socket in a child process and return its backplane URL.
+
+    Used by `python main.py` with WORKERS > 1; the broker exits with the parent.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    process = multiprocessing.Process(target=_run_unix, args=(path,), daemon=True, name="broker")
+    process.start()
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if not process.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"Broker did not start on {path}")
+        time.sleep(0.05)
+    return f"unix://{path}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Redis-protocol pub/sub broker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    parser.add_argument("--unix", dest="unix_path", help="Listen on a Unix socket instead of TCP")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.unix_path))
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")  # auto, orjson, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# WebSocket subprotocols. JSON text frames are the default; clients may opt in
+# to MessagePack binary frames, offered only when msgpack is installed.
+JSON_SUBPROTOCOL = "shadowchat.json"
+MSGPACK_SUBPROTOCOL = "shadowchat.msgpack"
+
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise RuntimeError("JSON_BACKEND=orjson but orjson is not installed")
+
+# dumps(obj) -> UTF-8 JSON bytes, loads(str or bytes) -> obj
+if orjson is not None and JSON_BACKEND != "json":
+    backend = "orjson"
+    dumps = orjson.dumps
+    loads = orjson.loads
+else:
+    backend = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    _decoder = json.JSONDecoder()
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode()
+
+    def loads(data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode()
+        return _decoder.decode(data)
+
+
+def dumps_text(obj) -> str:
+    return dumps(obj).decode()
+
+
+def pack(obj) -> bytes:
+    return msgpack.packb(obj)
+
+
+def unpack(data: bytes):
+    if msgpack is None:
+        raise ValueError("MessagePack frames need msgpack installed")
+    return msgpack.unpackb(data)
+
+
+def with_seq_text(text: str, seq: int) -> str:
+    """JSON object `text` with a leading "seq" field, without re-encoding the rest."""
+    return '{"seq":%d,%s' % (seq, text[1:])
+
+
+def with_seq_packed(frame: bytes, seq: int) -> bytes:
+    """MessagePack map `frame` with a "seq" entry added.
+
+    Small maps (fixmap, under 15 entries) only need their header bumped and
+    the entry prepended; anything else is decoded and packed again.
+    """
+    header = frame[0]
+    if 0x80 <= header < 0x8f:
+        return bytes((header + 1,)) + msgpack.packb("seq") + msgpack.packb(seq) + frame[1:]
+    return pack(dict(unpack(frame), seq=seq))
+
+
+def negotiate(offered) -> Optional[str]:
+    """Subprotocol to accept from the client's offer, in the server's order of preference."""
+    if MSGPACK_SUBPROTOCOL in offered and msgpack is not None:
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in offered:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+_second = -1
+_prefix = ""
+
+
+def utc_timestamp() -> str:
+    """Current UTC time as an ISO 8601 string, like datetime.utcnow().isoformat().
+
+    The date and time-of-day part is formatted once per second and reused;
+    microseconds are always included, so timestamps also sort as strings.
+    """
+    global _second, _prefix
+    now = time.time()
+    second = int(now)
+    if second != _second:
+        _second = second
+        _prefix = datetime.fromtimestamp(second, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    return "%s.%06d" % (_prefix, int((now - second) * 1000000))
+
+
+def parse_timestamp(text: str) -> datetime:
+    """ISO 8601 `text` as a naive UTC datetime; an offset ("Z", "+02:00") is applied.
+
+    Raises ValueError if `text` is not a timestamp.
+    """
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
@@ -0,0 +1 @@
+# Lets pytest import the app's top-level modules (journal, inbox, ...) from tests/
@@ -1,50 +1,262 @@
 # database.py - Updated for psycopg2
+import asyncio
+import heapq
 import os
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Text, DateTime, Boolean, ForeignKey, Integer
+from sqlalchemy import String, Text, DateTime, Boolean, ForeignKey, Integer, Index
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from datetime import datetime
 from typing import List, Optional
 
 # Get database URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")  # optional read replica
+
+# Pool tuning (shared by the sync and async engines)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
 
 # Convert to async psycopg2 format if needed
 if DATABASE_URL and DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg2://", 1)
 
+def _async_url(url: str) -> str:
+    """Driver URL for the async engine: asyncpg for Postgres, aiosqlite for SQLite."""
+    for prefix in ("postgresql+psycopg2://", "postgresql://"):
+        if url.startswith(prefix):
+            url = "postgresql+asyncpg://" + url[len(prefix):]
+            # asyncpg's own prepared statement cache, per connection
+            separator = "&" if "?" in url else "?"
+            return f"{url}{separator}prepared_statement_cache_size={DB_STATEMENT_CACHE_SIZE}"
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+def _engine_options(url: str) -> dict:
+    options = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "query_cache_size": DB_STATEMENT_CACHE_SIZE,  # SQLAlchemy compiled statement cache
+    }
+    if "sqlite" not in url:
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+class PoolStats:
+    """Time spent waiting for a pooled connection, per engine role."""
+
+    def __init__(self, size: int = 1024):
+        self.samples = deque(maxlen=size)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.max_wait_ms = 0.0
+
+    def record(self, ms: float):
+        self.samples.append(ms)
+        self.checkouts += 1
+        self.max_wait_ms = max(self.max_wait_ms, ms)
+
+    def snapshot(self, engine) -> dict:
+        ordered = sorted(self.samples)
+        pick = lambda p: round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3) if ordered else 0.0
+        pool = engine.pool
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_ms": {"p50": pick(0.5), "p99": pick(0.99), "max": round(self.max_wait_ms, 3)},
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "size": pool.size() if hasattr(pool, "size") else None,
+        }
+
 # Create engine
 engine = None
+async_engine = None
+async_read_engine = None
 async_session_maker = None
+async_read_session_maker = None
+pool_stats = {"primary": PoolStats(), "replica": PoolStats()}
 
 if DATABASE_URL:
-    # Use regular SQLAlchemy (not async) for psycopg2-binary
+    # Sync engine (psycopg2) for the write-behind worker thread and get_db
     from sqlalchemy import create_engine
     from sqlalchemy.orm import sessionmaker
     
-    engine = create_engine(DATABASE_URL)
+    # SQLite (local runs) is written from the persistence worker thread
+    connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+    engine = create_engine(DATABASE_URL, connect_args=connect_args, **_engine_options(DATABASE_URL))
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Simple cache
+    # Async engines for reads from the event loop; reads go to the replica when configured
+    async_engine = create_async_engine(_async_url(DATABASE_URL), **_engine_options(DATABASE_URL))
+    async_session_maker = async_sessionmaker(async_engine, expire_on_commit=False)
+    if DATABASE_READ_URL:
+        async_read_engine = create_async_engine(_async_url(DATABASE_READ_URL), **_engine_options(DATABASE_READ_URL))
+        async_read_session_maker = async_sessionmaker(async_read_engine, expire_on_commit=False)
+
+@asynccontextmanager
+async def async_session(read_only: bool = False):
+    """Async session that records how long the pool checkout took.
+
+    With `read_only`, the session is bound to the read replica if one is
+    configured.
+    """
+    use_replica = read_only and async_read_session_maker is not None
+    maker = async_read_session_maker if use_replica else async_session_maker
+    stats = pool_stats["replica" if use_replica else "primary"]
+
+    async with maker() as session:
+        start = time.perf_counter()
+        try:
+            await session.connection()
+        except PoolTimeoutError:  # pool_timeout elapsed waiting for a connection
+            stats.timeouts += 1
+            raise
+        stats.record((time.perf_counter() - start) * 1000)
+        yield session
+
+def database_stats() -> dict:
+    if async_engine is None:
+        return {}
+    stats = {"primary": pool_stats["primary"].snapshot(async_engine)}
+    if async_read_engine is not None:
+        stats["replica"] = pool_stats["replica"].snapshot(async_read_engine)
+    return stats
+
+# In-process cache with per-key TTL and an LRU bound on entries and bytes
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", "30"))
+
 class SimpleCache:
-    def __init__(self):
-        self.data = {}
-    
+    """Redis-style cache (get/setex/exists/delete) with TTL expiry and LRU eviction.
+
+    Expired keys are dropped lazily when read and by a sweep over an expiry
+    heap that runs at most every `sweep_interval` seconds, either from writes
+    or from the background task started by `start_sweeper`.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 sweep_interval: float = CACHE_SWEEP_INTERVAL):
+        self.data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self.expiry_heap: List[tuple] = []  # (expires_at, key), may hold stale entries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.bytes = 0
+        self.last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _size(key, value) -> int:
+        if isinstance(value, (str, bytes)):
+            return len(key) + len(value)
+        return len(key) + sys.getsizeof(value)
+
+    def _remove(self, key):
+        value, expires_at, size = self.data.pop(key)
+        self.bytes -= size
+
+    def _live(self, key, now: float) -> bool:
+        entry = self.data.get(key)
+        if entry is None:
+            return False
+        if entry[1] <= now:
+            self._remove(key)
+            self.expirations += 1
+            return False
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        self.last_sweep = now
+        removed = 0
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = self.data.get(key)
+            if entry is not None and entry[1] == expires_at:
+                self._remove(key)
+                removed += 1
+        # Stale heap entries from overwritten keys are compacted away eventually
+        if len(heap) > 2 * len(self.data) + 64:
+            self.expiry_heap = [(entry[1], key) for key, entry in self.data.items()]
+            heapq.heapify(self.expiry_heap)
+        self.expirations += removed
+        return removed
+
     async def setex(self, key, seconds, value):
-        self.data[key] = value
+        now = time.monotonic()
+        if now - self.last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+        if key in self.data:
+            self._remove(key)
+
+        expires_at = now + seconds
+        size = self._size(key, value)
+        self.data[key] = (value, expires_at, size)
+        self.bytes += size
+        heapq.heappush(self.expiry_heap, (expires_at, key))
+
+        while self.data and (len(self.data) > self.max_entries or self.bytes > self.max_bytes):
+            oldest = next(iter(self.data))
+            self._remove(oldest)
+            self.evictions += 1
     
     async def get(self, key):
-        return self.data.get(key)
+        if not self._live(key, time.monotonic()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return self.data[key][0]
     
     async def exists(self, key):
-        return key in self.data
+        return self._live(key, time.monotonic())
     
     async def delete(self, key):
-        self.data.pop(key, None)
+        if key in self.data:
+            self._remove(key)
+
+    def start_sweeper(self):
+        async def run():
+            while True:
+                await asyncio.sleep(self.sweep_interval)
+                self.sweep()
+
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(run())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
 
 _cache = SimpleCache()
 
 async def get_redis():
+    # Started on first use, on the loop that uses the cache
+    _cache.start_sweeper()
     return _cache
 
 # Database dependency (sync version for psycopg2)
@@ -67,7 +279,8 @@ class User(Base):
     __tablename__ = "users"
     
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
-    username: Mapped[str] = mapped_column(String(20), unique=True, nullable=False)
+    # Not unique: usernames are freed when a session ends and can be reused later
+    username: Mapped[str] = mapped_column(String(20), nullable=False)
     connected_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     last_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
@@ -87,6 +300,10 @@ class Group(Base):
 
 class GroupMember(Base):
     __tablename__ = "group_members"
+    __table_args__ = (
+        Index("ix_group_members_group_user", "group_id", "user_id", unique=True),
+        Index("ix_group_members_user", "user_id"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     group_id: Mapped[str] = mapped_column(String(36), ForeignKey("groups.id"))
@@ -96,6 +313,11 @@ class GroupMember(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # Keyset pagination walks (conversation, timestamp, id) in index order
+    __table_args__ = (
+        Index("ix_messages_group_timeline", "group_id", "timestamp", "id"),
+        Index("ix_messages_private_timeline", "private_chat_id", "timestamp", "id"),
+    )
     
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     sender_id: Mapped[str] = mapped_column(String(36), ForeignKey("users.id"))
@@ -105,7 +327,18 @@ class Message(Base):
     group_id: Mapped[Optional[str]] = mapped_column(String(36), ForeignKey("groups.id"))
     private_chat_id: Mapped[Optional[str]] = mapped_column(String(100))
 
+SYSTEM_USER_ID = "system"
+
 # Create tables (sync version)
 def create_tables():
     if engine:
-        Base.metadata.create_all(bind=engine)
\ No newline at end of file
+        Base.metadata.create_all(bind=engine)
+        # create_all skips tables that already exist; add indexes introduced since
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        # System messages are stored with sender_id "system"
+        with SessionLocal() as db:
+            if db.get(User, SYSTEM_USER_ID) is None:
+                db.add(User(id=SYSTEM_USER_ID, username="System", is_active=False))
+                db.commit()
\ No newline at end of file
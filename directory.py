@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+
+DIRECTORY_LOG_SIZE = int(os.environ.get("DIRECTORY_LOG_SIZE", 1024))
+
+
+class Directory:
+    """Versioned change log for the group directory.
+
+    Every group change bumps `version` and is kept in a bounded
+    log, so a client that knows version N can be brought up to date with the
+    changes after N, or with a full snapshot once N has fallen off the log.
+    """
+
+    def __init__(self, log_size: int = DIRECTORY_LOG_SIZE):
+        self.version = 0
+        self.log = deque(maxlen=log_size)  # (version, change)
+
+    def record(self, change: dict) -> dict:
+        """Apply a change to the log and return the delta frame announcing it."""
+        return self.record_many([change])
+
+    def record_many(self, changes: List[dict]) -> dict:
+        """Apply several changes, each with its own version, announced by a single delta frame."""
+        base = self.version
+        for change in changes:
+            self.version += 1
+            self.log.append((self.version, change))
+        return {"type": "directory_delta", "base": base, "version": self.version, "changes": changes}
+
+    def changes_since(self, version: int) -> Optional[List[dict]]:
+        if version == self.version:
+            return []
+        if version > self.version or not self.log or self.log[0][0] > version + 1:
+            return None
+        return [change for v, change in self.log if v > version]
+
+    def delta(self, version: Optional[int]) -> Optional[dict]:
+        """Frame that brings a client at `version` up to date; None when it needs a snapshot."""
+        changes = self.changes_since(version) if isinstance(version, int) else None
+        if changes is None:
+            return None
+        return {"type": "directory_delta", "base": version, "version": self.version, "changes": changes}
+
+
+class CachedListing:
+    """Pre-serialized JSON body of a listing, rebuilt only when the version of
+    its source (the directory, or presence digests) moves.
+
+    The ETag is derived from the body rather than the version, so it stays
+    valid when requests for the same client land on different nodes.
+    """
+
+    def __init__(self, source, build: Callable[[], list]):
+        self.source = source
+        self.build = build
+        self.version = -1
+        self.body = b""
+        self.etag = ""
+        self.rebuilds = 0
+        self.hits = 0
+
+    def get(self) -> Tuple[str, bytes]:
+        if self.version != self.source.version:
+            self.body = json.dumps(self.build()).encode()
+            self.etag = '"%s"' % hashlib.blake2b(self.body, digest_size=12).hexdigest()
+            self.version = self.source.version
+            self.rebuilds += 1
+        else:
+            self.hits += 1
+        return self.etag, self.body
+
+
+class SnapshotFrames:
+    """The `directory_snapshot` frame, encoded once per format and directory version.
+
+    Built from the groups listing's cached body, so a connect or a resync
+    costs a lookup rather than rebuilding and sorting every group.
+    """
+
+    def __init__(self, directory: Directory, groups: CachedListing, pack: Callable[[dict], bytes]):
+        self.directory = directory
+        self.groups = groups
+        self.pack = pack
+        self.frames = {}  # binary -> (version, frame)
+
+    def get(self, binary: bool):
+        version = self.directory.version
+        cached = self.frames.get(binary)
+        if cached is None or cached[0] != version:
+            _, body = self.groups.get()
+            if binary:
+                frame = self.pack({"type": "directory_snapshot", "version": version, "groups": json.loads(body)})
+            else:
+                frame = '{"type":"directory_snapshot","version":%d,"groups":%s}' % (version, body.decode())
+            cached = self.frames[binary] = (version, frame)
+        return cached[1]
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import random
+import signal
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from metrics import Counter
+
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", 20))  # seconds to drain before exiting; keep under stopTimeout
+DRAIN_RECONNECT_SPREAD = float(os.environ.get("DRAIN_RECONNECT_SPREAD", 10))  # seconds clients are spread over
+# Seconds without a load balancer health check that mean this target is being
+# deregistered; 0 turns the check off. Workers share one listening socket and
+# each check reaches only one of them, so a worker's own silence says nothing
+# about the target: the check is off when there is more than one.
+DRAIN_HEALTHCHECK_SILENCE = float(os.environ.get("DRAIN_HEALTHCHECK_SILENCE", 0))
+if int(os.environ.get("WORKERS", 1)) > 1:
+    DRAIN_HEALTHCHECK_SILENCE = 0
+
+# Close code sent to clients moved off a draining server (RFC 6455 "Service Restart")
+SERVICE_RESTART_CLOSE_CODE = 1012
+
+DRAINS = Counter("shadowchat_drains_total", "Times this process started draining", ("reason",))
+
+
+class Drain:
+    """Moves connected clients off a server that is about to go away.
+
+    Draining starts on SIGTERM, or when the load balancer stops health
+    checking this target (it does so once deregistration begins). New
+    sockets are turned away, and each client is told when to reconnect,
+    at a random point within `spread` so the remaining servers are not hit
+    all at once. A client that ignores the hint has its socket closed a
+    moment later, after the frames queued for it are sent. On SIGTERM the
+    process then exits through uvicorn's own handler, so the shutdown hooks
+    still flush persistence; a drain started by health check silence is
+    undone if the checks come back.
+    """
+
+    BACKSTOP = 2.0  # seconds past its hint before a client's socket is closed
+
+    def __init__(self, connections: Dict[str, object], notify: Callable[[str, dict], object],
+                 timeout: float = DRAIN_TIMEOUT, spread: float = DRAIN_RECONNECT_SPREAD,
+                 silence: float = DRAIN_HEALTHCHECK_SILENCE):
+        self.connections = connections  # user_id -> Outbox
+        self.notify = notify
+        self.timeout = timeout
+        self.spread = spread
+        self.silence = silence
+        self.draining = False
+        self.reason: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.last_health_check: Optional[float] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.previous_handler = None
+        self.exited = False
+        self.task: Optional[asyncio.Task] = None
+        self.watcher: Optional[asyncio.Task] = None
+        self.closes = []
+
+    def install(self):
+        """Take over SIGTERM; must run on the loop, after the server has set its own handlers."""
+        self.loop = asyncio.get_running_loop()
+        if self.silence > 0:
+            self.watcher = asyncio.create_task(self._watch())
+        if threading.current_thread() is not threading.main_thread():
+            return
+        self.previous_handler = signal.getsignal(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+
+    def _on_sigterm(self, signum, frame):
+        if self.draining and self.reason == "sigterm":
+            # A second SIGTERM skips what is left of the drain
+            self.exited = False
+            self._exit()
+            return
+        self.loop.call_soon_threadsafe(self.start, "sigterm")
+
+    def health_checked(self):
+        self.last_health_check = time.monotonic()
+        if self.draining and self.reason == "deregistered":
+            print("Load balancer health checks resumed; accepting connections again")
+            self.cancel()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(1)
+            last = self.last_health_check
+            if not self.draining and last is not None and time.monotonic() - last > self.silence:
+                self.start("deregistered")
+
+    def start(self, reason: str):
+        if self.draining and reason == self.reason:
+            return
+        self.cancel()
+        self.draining = True
+        self.reason = reason
+        self.started_at = time.monotonic()
+        DRAINS.labels(reason).inc()
+        self.task = asyncio.create_task(self._run(reason == "sigterm"))
+
+    def cancel(self):
+        self.draining = False
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for handle in self.closes:
+            handle.cancel()
+        self.closes = []
+
+    async def _run(self, exit: bool):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        # Leave time for the last sockets to be closed and queues flushed
+        spread = max(0.0, min(self.spread, self.timeout - self.BACKSTOP * 2))
+        print(f"Draining {len(self.connections)} connections over {spread:.0f}s ({self.reason})")
+        for user_id, outbox in list(self.connections.items()):
+            delay = random.uniform(0, spread)
+            self.notify(user_id, {"type": "server_draining", "reconnect_in": round(delay, 2)})
+            self.closes.append(loop.call_later(delay + self.BACKSTOP, outbox.finish,
+                                               SERVICE_RESTART_CLOSE_CODE, "Service restart"))
+        while self.connections and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if self.connections:
+            print(f"Drain timed out with {len(self.connections)} connections left")
+        if exit:
+            self._exit()
+
+    def _exit(self):
+        if self.exited:
+            return
+        self.exited = True
+        handler = self.previous_handler
+        if callable(handler):
+            handler(signal.SIGTERM, None)
+        elif threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, handler or signal.SIG_DFL)
+            signal.raise_signal(signal.SIGTERM)
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "draining": self.draining,
+            "reason": self.reason if self.draining else None,
+            "seconds": round(time.monotonic() - self.started_at, 1) if self.draining else None,
+            "connections": len(self.connections),
+            "healthcheck_silence": self.silence,
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+EPHEMERAL_WINDOW = float(os.environ.get("EPHEMERAL_WINDOW", 0.3))  # seconds between frames per chat
+PRESENCE_WINDOW = float(os.environ.get("PRESENCE_WINDOW", 1.0))  # seconds between presence digests
+
+Emit = Callable[[dict], Awaitable[None]]
+
+
+class Coalescer:
+    """Collects updates per chat and emits them at most once per `window`.
+
+    The first update in a quiet chat is flushed right away; updates arriving
+    within the window after a flush wait for the next one and are merged.
+    Subclasses keep the pending state and turn it into frames in `collect`.
+    """
+
+    def __init__(self, emit: Emit, window: float = EPHEMERAL_WINDOW):
+        self.emit = emit
+        self.window = window
+        self.last_flush: Dict[str, float] = {}
+        self.scheduled: Dict[str, asyncio.Task] = {}
+        self.received = 0
+        self.emitted = 0
+
+    def _schedule(self, chat_id: str):
+        self.received += 1
+        if chat_id in self.scheduled:
+            return
+        loop = asyncio.get_running_loop()
+        delay = self.last_flush.get(chat_id, float("-inf")) + self.window - loop.time()
+        self.scheduled[chat_id] = asyncio.create_task(self._flush_later(chat_id, max(delay, 0.0)))
+
+    async def _flush_later(self, chat_id: str, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        now = asyncio.get_running_loop().time()
+        del self.scheduled[chat_id]
+        self.last_flush[chat_id] = now
+        if len(self.last_flush) > 4096:
+            self.last_flush = {k: t for k, t in self.last_flush.items() if now - t < self.window}
+
+        for frame in self.collect(chat_id):
+            self.emitted += 1
+            try:
+                await self.emit(frame)
+            except Exception as e:
+                print(f"Failed to emit {frame['type']} for {chat_id}: {e!r}")
+
+    def collect(self, chat_id: str) -> List[dict]:
+        raise NotImplementedError
+
+    async def close(self):
+        for task in list(self.scheduled.values()):
+            task.cancel()
+        self.scheduled.clear()
+
+    def stats(self) -> dict:
+        return {"received": self.received, "emitted": self.emitted}
+
+
+class TypingCoalescer(Coalescer):
+    """Typing indicators as one `typing_update` frame per chat per window.
+
+    Only changes are sent: repeated `typing` events from someone already shown
+    as typing, or a start and stop within one window, produce no frame.
+    """
+
+    def __init__(self, emit: Emit, window: float = EPHEMERAL_WINDOW):
+        super().__init__(emit, window)
+        self.pending: Dict[str, Dict[str, Optional[str]]] = {}  # chat_id -> user_id -> username, None if stopped
+        self.announced: Dict[str, Dict[str, str]] = {}  # chat_id -> user_id -> username
+        self.chat_types: Dict[str, str] = {}
+
+    def update(self, chat_type: str, chat_id: str, user_id: str, username: str, typing: bool):
+        self.chat_types[chat_id] = chat_type
+        self.pending.setdefault(chat_id, {})[user_id] = username if typing else None
+        self._schedule(chat_id)
+
+    def forget(self, user_id: str):
+        """Stop every indicator `user_id` has showing, e.g. when they disconnect."""
+        for chat_id, typists in list(self.announced.items()):
+            if user_id in typists:
+                self.update(self.chat_types[chat_id], chat_id, user_id, typists[user_id], False)
+
+    def collect(self, chat_id: str) -> List[dict]:
+        changes = self.pending.pop(chat_id, {})
+        announced = self.announced.setdefault(chat_id, {})
+        started, stopped = [], []
+        for user_id, username in changes.items():
+            if username is not None and user_id not in announced:
+                announced[user_id] = username
+                started.append({"user_id": user_id, "username": username})
+            elif username is None and user_id in announced:
+                del announced[user_id]
+                stopped.append(user_id)
+
+        chat_type = self.chat_types[chat_id]
+        if not announced:
+            del self.announced[chat_id]
+            if chat_id not in self.pending:
+                del self.chat_types[chat_id]
+        if not started and not stopped:
+            return []
+        return [{
+            "type": "typing_update",
+            "chat_type": chat_type,
+            "chat_id": chat_id,
+            "started": started,
+            "stopped": stopped,
+        }]
+
+
+class ReceiptCoalescer(Coalescer):
+    """Delivered/seen receipts folded into a high-water mark per reader.
+
+    A receipt covers every earlier message of the chat, so only the latest
+    message per reader and status is sent, and a delivered mark is dropped
+    when a seen mark at least as recent goes out with it. `seq` orders
+    messages within a chat.
+    """
+
+    STATUSES = ("delivered", "seen")
+
+    def __init__(self, emit: Emit, window: float = EPHEMERAL_WINDOW):
+        super().__init__(emit, window)
+        self.pending: Dict[str, Dict[Tuple[str, str], Tuple[int, str]]] = {}  # chat_id -> (reader, status) -> (seq, id)
+        self.marks: Dict[Tuple[str, str, str], int] = {}  # (chat_id, reader, status) -> seq already sent
+
+    def update(self, chat_id: str, reader_id: str, message_id: str, status: str, seq: int):
+        if seq <= self.marks.get((chat_id, reader_id, status), -1):
+            return
+        pending = self.pending.setdefault(chat_id, {})
+        current = pending.get((reader_id, status))
+        if current is None or seq > current[0]:
+            pending[(reader_id, status)] = (seq, message_id)
+        self._schedule(chat_id)
+
+    def forget(self, user_id: str):
+        self.marks = {key: seq for key, seq in self.marks.items() if key[1] != user_id}
+
+    def collect(self, chat_id: str) -> List[dict]:
+        pending = self.pending.pop(chat_id, {})
+        frames = []
+        for (reader_id, status), (seq, message_id) in sorted(pending.items()):
+            if status == "delivered":
+                seen = pending.get((reader_id, "seen"))
+                if seen is not None and seen[0] >= seq:
+                    continue
+            self.marks[(chat_id, reader_id, status)] = seq
+            if status == "seen":
+                # Seen implies delivered
+                key = (chat_id, reader_id, "delivered")
+                self.marks[key] = max(seq, self.marks.get(key, -1))
+            frames.append({
+                "type": "message_status",
+                "chat_id": chat_id,
+                "user_id": reader_id,
+                "message_id": message_id,
+                "status": status,
+            })
+        return frames
+
+
+class PresenceCoalescer(Coalescer):
+    """Online/offline changes folded into one `presence` digest per window.
+
+    During a reconnect storm every connect used to cost a frame to every
+    socket; now a window's worth of changes costs one digest, which `emit`
+    scopes to the people who can see each changed user. Only each user's
+    latest state in the window is announced. `version` moves with every
+    digest, so listings of online users can be cached against it.
+    """
+
+    def __init__(self, emit: Emit, summary: Callable[[str], Optional[dict]], window: float = PRESENCE_WINDOW):
+        super().__init__(emit, window)
+        self.summary = summary
+        self.pending: Set[str] = set()  # user_ids whose presence changed
+        self.version = 0
+
+    def update(self, user_id: str):
+        self.pending.add(user_id)
+        self._schedule("presence")
+
+    def collect(self, chat_id: str) -> List[dict]:
+        pending, self.pending = self.pending, set()
+        if not pending:
+            return []
+        self.version += 1
+        online, offline = [], []
+        # Announce where each user stands now: a socket closing on one node
+        # after the user already reconnected on another leaves them online
+        for user_id in pending:
+            summary = self.summary(user_id)
+            if summary is not None:
+                online.append(summary)
+            else:
+                offline.append(user_id)
+        return [{"type": "presence", "online": online, "offline": offline}]
@@ -0,0 +1,224 @@
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+from codec import parse_timestamp
+
+HISTORY_SIZE = int(os.environ.get("HISTORY_SIZE", 500))
+HISTORY_SPILL_PATH = os.environ.get("HISTORY_SPILL_PATH")  # JSON lines file for evicted messages
+
+_intern = sys.intern
+
+
+class MessageRecord:
+    """Compact stored message. Sender and type strings are interned so
+    repeated values share one object across the whole history."""
+
+    __slots__ = ("id", "sender_id", "sender_username", "content", "timestamp", "message_type")
+
+    def __init__(self, id: str, sender_id: str, sender_username: str, content: str,
+                 timestamp: str, message_type: str = "text"):
+        self.id = id
+        self.sender_id = _intern(sender_id)
+        self.sender_username = _intern(sender_username)
+        self.content = content
+        self.timestamp = timestamp
+        self.message_type = _intern(message_type)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MessageRecord":
+        return cls(
+            data["id"],
+            data["sender_id"],
+            data["sender_username"],
+            data["content"],
+            data["timestamp"],
+            data.get("message_type", "text"),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "sender_id": self.sender_id,
+            "sender_username": self.sender_username,
+            "content": self.content,
+            "timestamp": self.timestamp,
+            "message_type": self.message_type,
+        }
+
+
+class History:
+    """Fixed-capacity ring buffer holding the latest messages of one conversation.
+
+    The backing list grows up to `capacity` and is then overwritten in place,
+    so a conversation never holds more than `capacity` records. Every record
+    gets a sequence number; `index` maps message id to sequence number for
+    the records still held, and timestamps are sought by binary search.
+    """
+
+    __slots__ = ("buffer", "capacity", "start", "total", "index")
+
+    def __init__(self, capacity: int = HISTORY_SIZE):
+        self.buffer: List[MessageRecord] = []
+        self.capacity = capacity
+        self.start = 0
+        self.total = 0
+        self.index: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def __getitem__(self, index: int) -> MessageRecord:
+        size = len(self.buffer)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("history index out of range")
+        return self.buffer[(self.start + index) % size]
+
+    def __iter__(self) -> Iterator[MessageRecord]:
+        return iter(self.range(0, len(self.buffer)))
+
+    def append(self, record: MessageRecord) -> Optional[MessageRecord]:
+        """Store a record, returning the record it displaced once full."""
+        seq = self.total
+        self.total += 1
+        self.index[record.id] = seq
+
+        if len(self.buffer) < self.capacity:
+            self.buffer.append(record)
+            return None
+        evicted = self.buffer[self.start]
+        if self.index.get(evicted.id) == seq - self.capacity:
+            del self.index[evicted.id]
+        self.buffer[self.start] = record
+        self.start = (self.start + 1) % self.capacity
+        return evicted
+
+    def range(self, lo: int, hi: int) -> List[MessageRecord]:
+        """Records at logical positions [lo, hi), oldest first, without copying the rest."""
+        size = len(self.buffer)
+        lo, hi = max(lo, 0), min(hi, size)
+        if lo >= hi:
+            return []
+        a, b = (self.start + lo) % size, (self.start + hi) % size
+        if a < b or b == 0:
+            return self.buffer[a:b or size]
+        return self.buffer[a:] + self.buffer[:b]
+
+    def locate(self, cursor: str, after: bool) -> int:
+        """Logical position where a page starting after (or ending before) `cursor` begins.
+
+        `cursor` is a message id still held in memory or an ISO timestamp.
+        """
+        seq = self.index.get(cursor)
+        if seq is not None:
+            position = seq - (self.total - len(self.buffer))
+            return position + 1 if after else position
+
+        # Stored timestamps are UTC with microseconds (utc_timestamp()), so
+        # the cursor is brought to the same form before comparing strings
+        try:
+            cursor = parse_timestamp(cursor).isoformat(timespec="microseconds")
+        except ValueError:
+            raise KeyError(cursor)
+
+        lo, hi = 0, len(self.buffer)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            timestamp = self[mid].timestamp
+            if timestamp < cursor or (after and timestamp == cursor):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def page(self, before: Optional[str] = None, after: Optional[str] = None,
+             limit: int = 50) -> List[MessageRecord]:
+        """Up to `limit` records between the cursors, oldest first.
+
+        With `after`, the page starts right after it (delta sync); otherwise it
+        is the `limit` records right before `before`, or the latest ones.
+        """
+        lo, hi = 0, len(self.buffer)
+        if after is not None:
+            lo = self.locate(after, after=True)
+        if before is not None:
+            hi = self.locate(before, after=False)
+        if after is not None:
+            return self.range(lo, min(hi, lo + limit))
+        return self.range(max(lo, hi - limit), hi)
+
+    def covers(self, page_size: int, after: Optional[str], limit: int) -> bool:
+        """Whether a page of `page_size` records taken from memory is complete,
+        or older records that were evicted could belong in it."""
+        if self.total == len(self.buffer):
+            return True
+        if after is not None:
+            return self.locate(after, after=True) > 0
+        return page_size == limit
+
+
+class FileSpill:
+    """Appends messages evicted from memory to a JSON lines file.
+
+    Lines are encoded on the caller's thread and written by a single writer
+    thread, in order, so eviction never blocks the event loop on disk.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "a", buffering=64 * 1024)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spill")
+
+    def __call__(self, conversation_id: str, record: MessageRecord):
+        line = record.to_dict()
+        line["conversation_id"] = conversation_id
+        self.executor.submit(self.file.write, json.dumps(line) + "\n")
+
+    def close(self):
+        """Write what is queued and close the file; blocks, so run it off the loop."""
+        self.executor.shutdown(wait=True)
+        self.file.close()
+
+
+class HistoryStore:
+    """Per-conversation bounded histories with an optional spill for evicted records."""
+
+    def __init__(self, capacity: int = HISTORY_SIZE,
+                 spill: Optional[Callable[[str, MessageRecord], None]] = None):
+        self.capacity = capacity
+        self.spill = spill
+        self.conversations: Dict[str, History] = {}
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self.conversations
+
+    def append(self, conversation_id: str, record: MessageRecord):
+        history = self.conversations.get(conversation_id)
+        if history is None:
+            history = self.conversations[conversation_id] = History(self.capacity)
+        evicted = history.append(record)
+        if evicted is not None and self.spill is not None:
+            self.spill(conversation_id, evicted)
+
+    def sequence(self, conversation_id: str, message_id: str) -> Optional[int]:
+        """Position of a message in its conversation, while it is held in memory."""
+        history = self.conversations.get(conversation_id)
+        return history.index.get(message_id) if history is not None else None
+
+    def page(self, conversation_id: str, before: Optional[str] = None,
+             after: Optional[str] = None, limit: int = 50) -> List[dict]:
+        history = self.conversations.get(conversation_id)
+        if history is None:
+            return []
+        return [record.to_dict() for record in history.page(before, after, limit)]
+
+    def covers(self, conversation_id: str, page_size: int, after: Optional[str], limit: int) -> bool:
+        history = self.conversations.get(conversation_id)
+        return history is not None and history.covers(page_size, after, limit)
+
+
+def create_spill() -> Optional[FileSpill]:
+    return FileSpill(HISTORY_SPILL_PATH) if HISTORY_SPILL_PATH else None
@@ -0,0 +1,114 @@
+import os
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+INBOX_SIZE = int(os.environ.get("INBOX_SIZE", 500))  # events kept per user for replay
+RECONNECT_GRACE = float(os.environ.get("RECONNECT_GRACE", 60))  # seconds a disconnected user is kept
+
+# Events replayed to a reconnecting client; presence and typing are not worth replaying
+SEQUENCED_EVENTS = ("private_message", "group_message", "message_status")
+
+
+class Inbox:
+    __slots__ = ("seq", "events")
+
+    def __init__(self, size: int):
+        self.seq = 0
+        self.events = deque(maxlen=size)  # (seq, event, frame)
+
+
+class DeliveryLog:
+    """Per-user delivery sequence numbers and a bounded inbox of recent events.
+
+    Every event delivered to a user, connected or not, gets that user's next
+    sequence number. A reconnecting client names the last one it saw and is
+    sent everything after it, as long as the inbox still reaches back that
+    far. Events are kept with their shared encoded frame, so a group message
+    costs one reference per member.
+    """
+
+    def __init__(self, size: int = INBOX_SIZE):
+        self.size = size
+        self.inboxes: Dict[str, Inbox] = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.gaps = 0
+
+    def record(self, user_id: str, event: dict, frame: Optional[str] = None) -> int:
+        inbox = self.inboxes.get(user_id)
+        if inbox is None:
+            inbox = self.inboxes[user_id] = Inbox(self.size)
+        inbox.seq += 1
+        inbox.events.append((inbox.seq, event, frame))
+        self.recorded += 1
+        return inbox.seq
+
+    def latest(self, user_id: str) -> int:
+        inbox = self.inboxes.get(user_id)
+        return inbox.seq if inbox is not None else 0
+
+    def since(self, user_id: str, seq: int, limit: Optional[int] = None) -> Tuple[List[tuple], bool]:
+        """Events after `seq`, and whether that is all of them (no gap).
+
+        More than `limit` missed events are not replayed at all; paging
+        through history is cheaper for the client than a flood of frames.
+        """
+        inbox = self.inboxes.get(user_id)
+        if inbox is None:
+            return [], seq == 0
+        if seq > inbox.seq:
+            # The client has seen numbers this log never issued
+            self.gaps += 1
+            return [], False
+        # Everything up to `floor` has been acked or pushed out of the inbox
+        floor = inbox.events[0][0] - 1 if inbox.events else inbox.seq
+        complete = seq >= floor
+        missed = [entry for entry in inbox.events if entry[0] > seq] if complete else []
+        if limit is not None and len(missed) > limit:
+            missed, complete = [], False
+        if not complete:
+            self.gaps += 1
+        self.replayed += len(missed)
+        return missed, complete
+
+    def ack(self, user_id: str, seq: int):
+        """Drop events the client has confirmed; they are never replayed again."""
+        inbox = self.inboxes.get(user_id)
+        if inbox is None:
+            return
+        while inbox.events and inbox.events[0][0] <= seq:
+            inbox.events.popleft()
+
+    def forget(self, user_id: str):
+        self.inboxes.pop(user_id, None)
+
+    def advance(self, user_id: str, count: int):
+        """Count `count` events as delivered without keeping them; resuming from before them is a gap."""
+        inbox = self.inboxes.get(user_id)
+        if inbox is None:
+            inbox = self.inboxes[user_id] = Inbox(self.size)
+        inbox.seq += count
+        inbox.events.clear()
+
+    def snapshot(self, events: bool = True) -> dict:
+        """Inboxes as plain data; with `events` false only the sequence numbers, which is far smaller."""
+        return {user_id: {"seq": inbox.seq,
+                          "events": [[seq, event] for seq, event, _ in inbox.events] if events else []}
+                for user_id, inbox in self.inboxes.items()}
+
+    def restore(self, snapshot: dict):
+        for user_id, state in snapshot.items():
+            if user_id in self.inboxes:
+                continue
+            inbox = self.inboxes[user_id] = Inbox(self.size)
+            inbox.seq = state["seq"]
+            inbox.events.extend((seq, event, None) for seq, event in state["events"])
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.inboxes),
+            "queued": sum(len(inbox.events) for inbox in self.inboxes.values()),
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "gaps": self.gaps,
+        }
@@ -0,0 +1,204 @@
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+from codec import dumps, loads
+
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH")  # state journal file; unset disables snapshots
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 1.0))  # seconds between log flushes
+SNAPSHOT_COMPACT_BYTES = int(os.environ.get("SNAPSHOT_COMPACT_BYTES", 32 << 20))  # log growth before compaction
+SNAPSHOT_FSYNC = os.environ.get("SNAPSHOT_FSYNC", "true").lower() == "true"
+
+MAGIC = b"SCJ1"
+LENGTH = struct.Struct("<I")
+
+
+class Journal:
+    """Append-only log of state events, compacted into a snapshot now and then.
+
+    The file is MAGIC followed by records: a 4-byte little-endian length
+    and an encoded JSON object. After compaction the first record is a full
+    state snapshot and the rest are events in the order they were applied.
+    Records are buffered and written by a background task every `interval`;
+    once the log has grown `compact_bytes` past the last snapshot, a fresh
+    snapshot is written to a temporary file and swapped in atomically.
+
+    Loading maps the file and walks the records without copying it; a torn
+    or undecodable record (a crash mid-write) ends the load, and `start`
+    cuts the file back to the last whole record before appending. Only one process may
+    own a journal, so workers sharing a path do not interleave writes.
+    """
+
+    def __init__(self, path: str, interval: float = SNAPSHOT_INTERVAL, compact_bytes: int = SNAPSHOT_COMPACT_BYTES,
+                 fsync: bool = SNAPSHOT_FSYNC):
+        self.path = path
+        self.interval = interval
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.buffer: List[bytes] = []
+        self.file = None
+        self.lock_fd: Optional[int] = None
+        self.size = 0
+        self.snapshot_size = 0
+        self.loaded_size: Optional[int] = None  # end of the last whole record read by load()
+        self.task: Optional[asyncio.Task] = None
+        # One writer thread keeps writes and rewrites in order, even when the
+        # task awaiting one is cancelled
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self.snapshot: Optional[Callable[[], dict]] = None
+        self.written = 0
+        self.compactions = 0
+        self.last_compaction_ms = 0.0
+        self.errors = 0
+
+    def acquire(self) -> bool:
+        """Take the journal's lock; False if another process owns it."""
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        return True
+
+    def load(self) -> Iterator[tuple]:
+        """(record, encoded record) pairs from the file on disk, oldest first."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(MAGIC):
+                # Empty, or torn while the header itself was being written
+                self.loaded_size = len(MAGIC) if size == len(MAGIC) and f.read() == MAGIC else 0
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(MAGIC)] != MAGIC:
+                    raise ValueError(f"{self.path} is not a state journal")
+                offset, end = len(MAGIC), len(data)
+                self.loaded_size = offset
+                while offset + LENGTH.size <= end:
+                    (length,) = LENGTH.unpack_from(data, offset)
+                    start = offset + LENGTH.size
+                    if start + length > end:
+                        break
+                    payload = data[start:start + length]
+                    try:
+                        record = loads(payload)
+                    except ValueError:
+                        record = None
+                    if not isinstance(record, dict):
+                        break
+                    yield record, payload
+                    offset = start + length
+                    self.loaded_size = offset
+                if offset != end:
+                    print(f"Ignoring {end - offset} bytes from a torn or corrupt record in {self.path}")
+
+    def start(self, snapshot: Callable[[], dict]):
+        """Start appending; `snapshot` returns the full state for compaction."""
+        self.snapshot = snapshot
+        self.file = open(self.path, "ab")
+        if self.loaded_size is not None and self.file.tell() > self.loaded_size:
+            # Appending after a torn record would hide everything after it
+            self.file.truncate(self.loaded_size)
+            self.file.seek(self.loaded_size)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.size = self.snapshot_size = self.file.tell()
+        self.task = asyncio.create_task(self._run())
+
+    def append(self, frame: bytes):
+        if self.file is not None:
+            self.buffer.append(frame)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+                if self.size - self.snapshot_size > self.compact_bytes:
+                    await self.compact()
+            except OSError as e:
+                self.errors += 1
+                print(f"State journal write failed: {e!r}")
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        records, self.buffer = self.buffer, []
+        data = b"".join(LENGTH.pack(len(record)) + record for record in records)
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write, data)
+        self.size += len(data)
+        self.written += len(records)
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    async def compact(self):
+        """Replace the log with one snapshot record of the current state."""
+        start = time.perf_counter()
+        # Taken on the loop together with dropping the buffer: every buffered
+        # event is already part of the state
+        state = self.snapshot()
+        self.buffer = []
+        size = await asyncio.get_running_loop().run_in_executor(self.executor, self._rewrite, state)
+        self.size = self.snapshot_size = size
+        self.compactions += 1
+        self.last_compaction_ms = (time.perf_counter() - start) * 1000
+
+    def _rewrite(self, state: dict) -> int:
+        record = dumps({"type": "state_snapshot", "state": state})
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(MAGIC + LENGTH.pack(len(record)) + record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.file.close()
+        self.file = open(self.path, "ab")
+        return self.file.tell()
+
+    async def close(self):
+        """Write the latest state as a snapshot, so the next start reads a single
+        record; run on shutdown, within the SIGTERM grace period."""
+        if self.task is not None:
+            self.task.cancel()
+        if self.file is None:
+            return
+        try:
+            await self.compact()
+        except OSError as e:
+            print(f"State journal flush on shutdown failed: {e!r}")
+        self.executor.shutdown(wait=True)
+        self.file.close()
+        self.file = None
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "bytes": self.size,
+            "log_bytes": self.size - self.snapshot_size,
+            "buffered": len(self.buffer),
+            "written": self.written,
+            "compactions": self.compactions,
+            "last_compaction_ms": round(self.last_compaction_ms, 1),
+            "errors": self.errors,
+        }
+
+
+def create_journal() -> Optional[Journal]:
+    return Journal(SNAPSHOT_PATH) if SNAPSHOT_PATH else None
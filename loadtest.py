@@ -0,0 +1,250 @@
+"""Load generator: N simulated clients against a local server.
+
+    python loadtest.py --scenario groups
+    python loadtest.py --scenario private --clients 500 --duration 60 --json before.json
+    python loadtest.py --url http://127.0.0.1:8000 --pid 1234   # an already running server
+
+Without --url, a uvicorn instance of main:app is started on --port and
+stopped afterwards. Clients create users, join groups and send private and
+group messages at a seeded Poisson rate, so a scenario with the same seed
+sends the same traffic. Reports end-to-end delivery latency (send to
+receipt by each recipient), throughput and server RSS growth.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+import websockets
+
+SCENARIOS = {
+    # clients, groups, group_size, rate (messages/sec per client), private (share of private messages)
+    "smoke": {"clients": 20, "groups": 2, "group_size": 10, "rate": 1.0, "private": 0.5, "duration": 10},
+    "private": {"clients": 200, "groups": 0, "group_size": 0, "rate": 1.0, "private": 1.0, "duration": 30},
+    "groups": {"clients": 200, "groups": 10, "group_size": 40, "rate": 0.5, "private": 0.2, "duration": 30},
+    "large-group": {"clients": 500, "groups": 1, "group_size": 500, "rate": 0.05, "private": 0.0, "duration": 30},
+    "idle": {"clients": 2000, "groups": 20, "group_size": 100, "rate": 0.0, "private": 0.0, "duration": 30},
+}
+
+
+def http(base: str, method: str, path: str, body: Optional[dict] = None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(base + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+    while True:
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # Setup calls all come from one address and run into the REST rate limit
+            if e.code != 429:
+                raise
+            time.sleep(float(e.headers.get("Retry-After", 1)))
+
+
+def rss_kb(pid: Optional[int]) -> Optional[int]:
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class Run:
+    def __init__(self, args):
+        self.args = args
+        self.base = args.url.rstrip("/")
+        self.ws_base = self.base.replace("http", "ws", 1)
+        self.users: List[str] = []
+        self.groups: List[str] = []
+        self.groups_of: Dict[int, List[str]] = {}
+        self.sent_at: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.delivered = 0
+        self.errors = 0
+        self.sending = True
+
+    async def setup(self):
+        rng = random.Random(self.args.seed)
+        for i in range(self.args.clients):
+            user = await asyncio.to_thread(http, self.base, "POST", "/api/create-user", {"username": f"lt{i}"})
+            self.users.append(user["user_id"])
+
+        for g in range(self.args.groups):
+            members = rng.sample(range(self.args.clients), min(self.args.group_size, self.args.clients))
+            group = await asyncio.to_thread(http, self.base, "POST", "/api/create-group",
+                                            {"user_id": self.users[members[0]], "name": f"load{g}"})
+            for i in members[1:]:
+                await asyncio.to_thread(http, self.base, "POST", "/api/join-group",
+                                        {"user_id": self.users[i], "group_id": group["group_id"]})
+            for i in members:
+                self.groups_of.setdefault(i, []).append(group["group_id"])
+            self.groups.append(group["group_id"])
+
+    async def client(self, i: int, connected: asyncio.Event, start: asyncio.Event):
+        rng = random.Random(self.args.seed * 1000003 + i)
+        await asyncio.sleep(self.args.ramp * i / max(self.args.clients, 1))
+        async with websockets.connect(f"{self.ws_base}/ws/{self.users[i]}", max_size=None) as ws:
+            receiver = asyncio.create_task(self.receive(ws, i))
+            connected.set()
+            await start.wait()
+            seq = 0
+            while self.sending and self.args.rate > 0:
+                await asyncio.sleep(rng.expovariate(self.args.rate))
+                if not self.sending:
+                    break
+                message_id = f"lt{i}-{seq}"
+                seq += 1
+                if rng.random() < self.args.private or not self.groups_of.get(i):
+                    peer = rng.randrange(self.args.clients - 1)
+                    frame = {"type": "private_message", "recipient_id": self.users[peer + (peer >= i)]}
+                else:
+                    frame = {"type": "group_message", "group_id": rng.choice(self.groups_of[i])}
+                frame.update(content="x" * self.args.size, message_id=message_id)
+                self.sent_at[message_id] = time.perf_counter()
+                try:
+                    await ws.send(json.dumps(frame))
+                    self.sent += 1
+                except websockets.ConnectionClosed:
+                    self.errors += 1
+                    break
+            await asyncio.sleep(self.args.drain)
+            receiver.cancel()
+
+    async def receive(self, ws, i: int):
+        own = f"lt{i}-"
+        try:
+            async for raw in ws:
+                data = json.loads(raw)
+                if data.get("type") not in ("private_message", "group_message"):
+                    continue
+                message_id = data["message"]["id"]
+                sent_at = self.sent_at.get(message_id)
+                if sent_at is not None and not message_id.startswith(own):
+                    self.latencies.append((time.perf_counter() - sent_at) * 1000)
+                    self.delivered += 1
+        except websockets.ConnectionClosed:
+            self.errors += 1
+
+    async def run(self, pid: Optional[int]) -> dict:
+        await self.setup()
+        connected = [asyncio.Event() for _ in self.users]
+        start = asyncio.Event()
+        tasks = [asyncio.create_task(self.client(i, connected[i], start)) for i in range(len(self.users))]
+        await asyncio.gather(*(event.wait() for event in connected))
+        await asyncio.sleep(1)  # let presence fan-out settle
+
+        rss_start = rss_kb(pid)
+        rss_peak = rss_start or 0
+        began = time.perf_counter()
+        start.set()
+        while time.perf_counter() - began < self.args.duration:
+            await asyncio.sleep(1)
+            rss_peak = max(rss_peak, rss_kb(pid) or 0)
+            print(f"\r{time.perf_counter() - began:5.0f}s sent={self.sent} delivered={self.delivered}",
+                  end="", file=sys.stderr)
+        elapsed = time.perf_counter() - began
+        self.sending = False
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print(file=sys.stderr)
+        rss_end = rss_kb(pid)
+
+        return {
+            "scenario": self.args.scenario,
+            "clients": self.args.clients,
+            "groups": self.args.groups,
+            "group_size": self.args.group_size,
+            "seed": self.args.seed,
+            "duration_s": round(elapsed, 1),
+            "sent": self.sent,
+            "delivered": self.delivered,
+            "sent_per_s": round(self.sent / elapsed, 1),
+            "delivered_per_s": round(self.delivered / elapsed, 1),
+            "latency_ms": {f"p{p}": round(percentile(self.latencies, p), 2) for p in (50, 90, 99)},
+            "latency_max_ms": round(max(self.latencies, default=0.0), 2),
+            "errors": self.errors,
+            "rss_kb": {"start": rss_start, "peak": rss_peak or None, "end": rss_end},
+            "rss_growth_kb": rss_end - rss_start if rss_start and rss_end else None,
+        }
+
+
+def start_server(port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=sys.stderr,  # keep stdout for the report
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            http(f"http://127.0.0.1:{port}", "GET", "/health")
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="smoke")
+    parser.add_argument("--clients", type=int)
+    parser.add_argument("--groups", type=int)
+    parser.add_argument("--group-size", type=int)
+    parser.add_argument("--rate", type=float, help="messages per second per client")
+    parser.add_argument("--private", type=float, help="share of private messages (0-1)")
+    parser.add_argument("--duration", type=float, help="seconds of sending")
+    parser.add_argument("--size", type=int, default=64, help="message content length")
+    parser.add_argument("--ramp", type=float, default=2, help="seconds over which clients connect")
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait for deliveries after sending")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--pid", type=int, help="server pid for RSS sampling with --url")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    for key, value in SCENARIOS[args.scenario].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+
+    server = None
+    if args.url is None:
+        server = start_server(args.port)
+        args.url = f"http://127.0.0.1:{args.port}"
+        args.pid = server.pid
+    try:
+        report = asyncio.run(Run(args).run(args.pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -647,16 +647,34 @@
 #     uvicorn.run(app, host="0.0.0.0", port=port)
 
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import json
 import uuid
+import time
+import asyncio
 import hashlib
-from datetime import datetime
-from typing import Dict
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from backplane import LocalBackplane, create_backplane
+from broadcast import Broadcaster
+from codec import MSGPACK_SUBPROTOCOL, dumps, loads, negotiate, pack, unpack, utc_timestamp
+from directory import CachedListing, Directory, SnapshotFrames
+from drain import SERVICE_RESTART_CLOSE_CODE, Drain
+from ephemeral import PresenceCoalescer, ReceiptCoalescer, TypingCoalescer
+from history import HistoryStore, MessageRecord, create_spill
+from inbox import RECONNECT_GRACE, SEQUENCED_EVENTS, DeliveryLog
+from journal import create_journal
+import metrics
+from membership import Membership
+from watchdog import Watchdog
+from outbound import Outbox
+from ratelimit import (GROUP_SEND_BURST, GROUP_SEND_RATE, REST_BURST, REST_RATE, USER_SEND_BURST, USER_SEND_RATE,
+                       AdmissionController, RateLimiter)
 
 app = FastAPI()
 
@@ -670,10 +688,33 @@ app.add_middleware(
 
 # In-memory storage
 users: Dict[str, dict] = {}
-connections: Dict[str, WebSocket] = {}
+connections: Dict[str, Outbox] = {}
 groups: Dict[str, dict] = {}
-messages: Dict[str, list] = {}
-private_chats: Dict[str, list] = {}
+history_spill = create_spill()
+messages = HistoryStore(spill=history_spill)  # group_id -> bounded history
+private_chats = HistoryStore(spill=history_spill)  # chat_id -> bounded history
+presence: Dict[str, str] = {}  # user_id -> node_id holding the socket
+usernames: Dict[str, str] = {}  # case-folded username -> user_id
+membership = Membership()  # group_id <-> user_id sets
+deliveries = DeliveryLog()  # user_id -> delivery sequence and offline inbox
+departures: Dict[str, asyncio.Task] = {}  # user_id -> removal pending after a disconnect
+
+broadcaster = Broadcaster(connections)
+backplane = create_backplane()
+drain = Drain(connections, broadcaster.send)  # moves clients elsewhere before this process goes away
+
+# Optional write-behind persistence, only when a database is configured
+persistence = None
+if os.environ.get("DATABASE_URL"):
+    from database import async_engine, create_tables, database_stats
+    from persistence import create_write_behind, event_rows
+    import queries
+    persistence = create_write_behind()
+
+# On-disk snapshot and event log, restored from when no peer has the state
+journal = create_journal()
+JOURNALED_EVENTS = {"user_created", "user_removed", "group_created", "group_joined", "private_message",
+                    "group_message", "message_status"}
 
 def generate_id():
     return str(uuid.uuid4())
@@ -684,60 +725,704 @@ def hash_password(password: str) -> str:
 def get_private_chat_id(user1_id: str, user2_id: str) -> str:
     return f"chat_{'_'.join(sorted([user1_id, user2_id]))}"
 
+def chat_participants(chat_id: str) -> list:
+    return chat_id[len("chat_"):].split("_") if chat_id.startswith("chat_") else []
+
+MAX_PAGE_SIZE = 200
+
+async def page_history(store: HistoryStore, chat_id: str, before: Optional[str], after: Optional[str],
+                       limit: int, column: str):
+    """Serve a page from memory, falling back to the database for messages
+    that have been evicted from the in-memory window."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    try:
+        page = store.page(chat_id, before=before, after=after, limit=limit)
+        if persistence is None or store.covers(chat_id, len(page), after, limit):
+            return page
+    except KeyError:
+        if persistence is None:
+            raise HTTPException(status_code=400, detail="Unknown cursor")
+
+    try:
+        return await queries.history_page(column, chat_id, before=before, after=after, limit=limit)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Unknown cursor")
+
 # API Routes
+@app.middleware("http")
+async def record_http_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_SECONDS.labels(request.method, route.path if route else "unmatched",
+                                str(response.status_code)).observe(time.perf_counter() - start)
+    return response
+
+# Token buckets: REST calls per user (or client address), messages per user and per group
+rest_limiter = RateLimiter("rest", REST_RATE, REST_BURST)
+user_sends = RateLimiter("user_send", USER_SEND_RATE, USER_SEND_BURST)
+group_sends = RateLimiter("group_send", GROUP_SEND_RATE, GROUP_SEND_BURST)
+admission = AdmissionController()
+RATE_LIMITED_TYPES = ("private_message", "group_message", "directory_sync")
+
+@app.middleware("http")
+async def limit_rest_calls(request: Request, call_next):
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    # Keyed on the caller's address: a user_id in the query string is public and
+    # proves nothing, so keying on it would let a client rotate through ids or
+    # spend someone else's budget. The load balancer appends the address it
+    # saw, so the last X-Forwarded-For hop is the one a client cannot forge.
+    forwarded = request.headers.get("x-forwarded-for")
+    key = forwarded.split(",")[-1].strip() if forwarded else (request.client.host if request.client else "")
+    retry = rest_limiter.allow(key)
+    if retry is not None:
+        return Response(content=dumps({"detail": "Too many requests"}), status_code=429,
+                        media_type="application/json", headers={"Retry-After": str(int(retry) + 1)})
+    return await call_next(request)
+
+@app.middleware("http")
+async def note_health_checks(request: Request, call_next):
+    # The load balancer stops checking a target once it starts deregistering it
+    if request.headers.get("user-agent", "").startswith("ELB-HealthChecker"):
+        drain.health_checked()
+    return await call_next(request)
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "connections": len(connections)}
+    return {
+        "status": "ok",
+        "connections": len(connections),
+        "fanout": broadcaster.stats(),
+        "typing": typing_indicators.stats(),
+        "receipts": receipts.stats(),
+        "inbox": deliveries.stats(),
+        "admission": admission.stats(),
+        "rate_limits": {limiter.scope: limiter.stats() for limiter in (rest_limiter, user_sends, group_sends)},
+        "backplane": backplane.stats(),
+        "peers": len(node_seen),
+        "persistence": persistence.stats() if persistence is not None else None,
+        "database": database_stats() if persistence is not None else None,
+        "journal": journal.stats() if journal is not None else None,
+        "drain": drain.stats()
+    }
 
-@app.post("/api/create-user")
-async def create_user(data: dict):
+# Metrics
+CLIENT_MESSAGE_TYPES = {"private_message", "group_message", "typing", "stop_typing", "message_status", "directory_sync",
+                        "ack", "end_session"}
+loop_lag = metrics.LoopLagMonitor()
+watchdog = Watchdog()
+loop_thread: Optional[int] = None
+emf_task: Optional[asyncio.Task] = None
+
+metrics.Gauge("shadowchat_connections", "Open WebSocket connections on this process", collect=lambda: len(connections))
+metrics.Gauge("shadowchat_users", "Users known to this process", collect=lambda: len(users))
+metrics.Gauge("shadowchat_groups", "Groups known to this process", collect=lambda: len(groups))
+metrics.Gauge("shadowchat_outbox_queued", "Frames waiting in outboxes", ("stat",),
+              collect=lambda: {(k,): v for k, v in broadcaster.queue_depths().items()})
+metrics.Gauge("shadowchat_outbox_events_total", "Outbox drops, evictions, timeouts and send failures",
+              ("event",), kind="counter",
+              collect=lambda: {(k,): getattr(broadcaster, k)
+                               for k in ("dropped", "evicted", "timeouts", "failures")})
+metrics.Gauge("shadowchat_persistence_queued", "Rows waiting for the write-behind flusher",
+              collect=lambda: len(persistence.pending) if persistence is not None else 0)
+metrics.Gauge("shadowchat_listing_cache_total", "Directory listing cache hits and rebuilds", ("listing", "result"),
+              kind="counter",
+              collect=lambda: {("users", "hit"): online_users_listing.hits, ("users", "rebuild"): online_users_listing.rebuilds,
+                               ("groups", "hit"): groups_listing.hits, ("groups", "rebuild"): groups_listing.rebuilds})
+metrics.Gauge("shadowchat_backplane_events_total", "Backplane events published and received", ("direction",),
+              kind="counter",
+              collect=lambda: {("published",): backplane.published, ("received",): backplane.received})
+metrics.Gauge("shadowchat_inbox_queued", "Events kept in delivery inboxes for replay",
+              collect=lambda: deliveries.stats()["queued"])
+metrics.Gauge("shadowchat_inbox_events_total", "Inbox events recorded and replayed, and resumes that hit a gap",
+              ("event",), kind="counter",
+              collect=lambda: {(k,): v for k, v in deliveries.stats().items() if k in ("recorded", "replayed", "gaps")})
+metrics.Gauge("shadowchat_rate_limit", "Configured token bucket rates (per second) and bursts", ("scope", "param"),
+              collect=lambda: {(limiter.scope, param): getattr(limiter, param)
+                               for limiter in (rest_limiter, user_sends, group_sends) for param in ("rate", "burst")})
+metrics.Gauge("shadowchat_rate_limit_keys", "Users, groups and addresses with a live token bucket", ("scope",),
+              collect=lambda: {(limiter.scope,): len(limiter.buckets)
+                               for limiter in (rest_limiter, user_sends, group_sends)})
+metrics.Gauge("shadowchat_event_loop_lag_last_seconds", "Most recent event loop lag probe", collect=lambda: loop_lag.last)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profile")
+async def profile(seconds: float = 5, hz: float = 100):
+    """Collapsed stacks of the event loop thread, sampled while the request runs."""
+    if not metrics.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+    seconds, hz = max(0, min(seconds, 60)), max(1, min(hz, 1000))
+    text = await asyncio.to_thread(metrics.sample_stacks, loop_thread, seconds, hz)
+    return PlainTextResponse(text)
+
+@app.get("/debug/stalls")
+async def recent_stalls():
+    """Recent event loop stalls with the blocked stack and the handler running at the time."""
+    if not metrics.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+    return watchdog.recent()
+
+def emf_values() -> dict:
+    lag_ms, loop_lag.window_max = loop_lag.window_max * 1000, 0.0
+    return {"Connections": (len(connections), "Count"), "EventLoopLagMs": (lag_ms, "Milliseconds")}
+
+# Cross-node events: the publishing node applies the state change before
+# publishing; every other node applies it on receipt. Every node, including
+# the publisher, then delivers the event to its own local sockets.
+def apply_event(node_id: str, event: dict):
+    kind = event["type"]
+    
+    if kind == "user_created":
+        user = event["user"]
+        users[user["id"]] = user
+        usernames[user["username"].casefold()] = user["id"]
+    
+    elif kind == "user_online":
+        presence[event["user"]["id"]] = node_id
+        departure = departures.pop(event["user"]["id"], None)
+        if departure is not None:
+            departure.cancel()
+    
+    elif kind == "user_offline":
+        if presence.get(event["user_id"]) == node_id:
+            del presence[event["user_id"]]
+    
+    elif kind == "user_removed":
+        user = users.pop(event["user_id"], None)
+        if user is not None and usernames.get(user["username"].casefold()) == user["id"]:
+            del usernames[user["username"].casefold()]
+        presence.pop(event["user_id"], None)
+        membership.remove_user(event["user_id"])
+        deliveries.forget(event["user_id"])
+    
+    elif kind == "group_created":
+        group = event["group"]
+        groups[group["id"]] = group
+        membership.add(group["id"], group["creator_id"])
+        append_message(messages, group["id"], event["message"])
+    
+    elif kind == "group_joined":
+        membership.add(event["group_id"], event["user_id"])
+        append_message(messages, event["group_id"], event["message"])
+    
+    elif kind == "private_message":
+        append_message(private_chats, event["chat_id"], event["message"])
+        membership.add_peer(event["message"]["sender_id"], event["recipient_id"])
+    
+    elif kind == "group_message":
+        append_message(messages, event["group_id"], event["message"])
+
+def append_message(store: HistoryStore, conversation_id: str, message: dict):
+    # A peer's snapshot may already hold a message whose event is replayed on top of it
+    if store.sequence(conversation_id, message["id"]) is None:
+        store.append(conversation_id, MessageRecord.from_dict(message))
+
+def deliver_event(event: dict, frame: bytes):
+    kind = event["type"]
+    
+    # Presence goes out as one digest per window
+    if kind == "user_online":
+        presence_digests.update(event["user"]["id"])
+    
+    elif kind == "user_offline":
+        presence_digests.update(event["user_id"])
+    
+    elif kind == "user_removed":
+        for group_id in event.get("groups", []):
+            if group_id in groups:
+                broadcaster.broadcast(directory.record({"op": "group_updated", "group": group_summary(groups[group_id])}),
+                                      list(connections))
+    
+    elif kind in ("group_created", "group_joined"):
+        group = groups.get(event["group"]["id"] if kind == "group_created" else event["group_id"])
+        if group is not None:
+            op = "group_created" if kind == "group_created" else "group_updated"
+            broadcaster.broadcast(directory.record({"op": op, "group": group_summary(group)}), list(connections))
+    
+    # Message events are sent to clients as-is, reusing the publisher's encoding,
+    # with each recipient's delivery sequence number spliced in
+    elif kind == "private_message":
+        deliver_sequenced(event, frame, {event["message"]["sender_id"], event["recipient_id"]})
+    
+    elif kind == "group_message":
+        deliver_sequenced(event, frame, membership.members_of(event["group_id"]))
+    
+    # Ephemeral events, already coalesced by the publishing node
+    elif kind == "typing_update":
+        if event["chat_type"] == "group":
+            recipients = membership.members_of(event["chat_id"])
+        else:
+            recipients = chat_participants(event["chat_id"])
+        broadcaster.broadcast_frame(event, frame.decode(), recipients)
+    
+    elif kind == "message_status":
+        recipients = [uid for uid in chat_participants(event["chat_id"]) if uid != event["user_id"]]
+        deliver_sequenced(event, frame, recipients)
+
+def deliver_sequenced(event: dict, frame: bytes, recipients):
+    """Number the event in every recipient's inbox, connected or not, and send it to those connected.
+
+    Every node runs this in backplane order, so each node hands out the
+    same numbers and a client can resume on any of them.
+    """
+    text = frame.decode()
+    seqs = {uid: deliveries.record(uid, event, text) for uid in recipients if uid in users}
+    broadcaster.broadcast_sequenced(event, text, seqs)
+
+def replay_missed(user_id: str, last_seq: Optional[int], limit: int):
+    """Resend what `user_id` missed after `last_seq`, then tell the client where it stands.
+
+    `complete` is false when the inbox no longer reaches back that far; the
+    client then pages through the history endpoints instead.
+    """
+    missed, complete = [], True
+    if last_seq is not None:
+        missed, complete = deliveries.since(user_id, last_seq, limit)
+    for seq, event, text in missed:
+        broadcaster.broadcast_sequenced(event, text, {user_id: seq})
+    broadcaster.send(user_id, {
+        "type": "inbox_sync",
+        "seq": deliveries.latest(user_id),
+        "replayed": len(missed),
+        "complete": complete
+    })
+
+# A node (or worker) joining a running cluster asks its peers for their state.
+# Events received meanwhile are held back and applied on top of the snapshot.
+STATE_SYNC_TIMEOUT = float(os.environ.get("STATE_SYNC_TIMEOUT", 2))
+STATE_SYNC_DEADLINE = float(os.environ.get("STATE_SYNC_DEADLINE", 30))  # seconds a worker waits for the journal owner
+state_synced = asyncio.Event()
+state_reply: Optional[asyncio.Future] = None
+state_request_id: Optional[str] = None  # the request state_reply is waiting on
+sync_buffer = deque()  # (node_id, event, frame) received before state_synced
+state_claims: Dict[str, str] = {}  # state request id -> node_id answering it
+
+def state_snapshot(inbox_events: bool = True) -> dict:
+    return {
+        "users": list(users.values()),
+        "groups": list(groups.values()),
+        "members": {group_id: sorted(members) for group_id, members in membership.members.items()},
+        "presence": presence,
+        "messages": {cid: [r.to_dict() for r in history] for cid, history in messages.conversations.items()},
+        "private_chats": {cid: [r.to_dict() for r in history] for cid, history in private_chats.conversations.items()},
+        "inboxes": deliveries.snapshot(events=inbox_events),
+    }
+
+def restore_state(snapshot: dict):
+    """Merge a peer's snapshot; anything this node already applied itself wins."""
+    for user in snapshot["users"]:
+        if user["id"] not in users:
+            users[user["id"]] = user
+            usernames.setdefault(user["username"].casefold(), user["id"])
+    for group in snapshot["groups"]:
+        groups.setdefault(group["id"], group)
+    for group_id, members in snapshot["members"].items():
+        for member_id in members:
+            membership.add(group_id, member_id)
+    for user_id, node_id in snapshot["presence"].items():
+        presence.setdefault(user_id, node_id)
+    for store, conversations in ((messages, snapshot["messages"]), (private_chats, snapshot["private_chats"])):
+        for conversation_id, records in conversations.items():
+            if conversation_id not in store:
+                for record in records:
+                    store.append(conversation_id, MessageRecord.from_dict(record))
+    for chat_id in snapshot["private_chats"]:
+        participants = chat_participants(chat_id)
+        if len(participants) == 2:
+            membership.add_peer(*participants)
+    deliveries.restore(snapshot.get("inboxes", {}))
+
+def journal_state() -> dict:
+    # Nobody is connected to a process that has just started. Inboxes keep
+    # only their sequence numbers: a copy of every event per recipient would
+    # dwarf the rest of the state.
+    return dict(state_snapshot(inbox_events=False), presence={})
+
+def restore_journal():
+    """Rebuild state from the on-disk journal: the last snapshot, then the events logged after it."""
+    start = time.perf_counter()
+    records = 0
+    # Events logged after the snapshot still advance their recipients'
+    # delivery sequence numbers, so a client resuming from before the restart
+    # sees a gap and pages through history. Group messages are counted per
+    # group and credited to the members once at the end; a member who joined
+    # late is over-counted, which only costs them a page of history.
+    delivered: Dict[str, int] = {}
+    group_messages: Dict[str, int] = {}
+    for record, _ in journal.load():
+        records += 1
+        kind = record["type"]
+        if kind == "state_snapshot":
+            restore_state(record["state"])
+            continue
+        apply_event(backplane.node_id, record)
+        if kind == "group_message":
+            group_messages[record["group_id"]] = group_messages.get(record["group_id"], 0) + 1
+        elif kind in SEQUENCED_EVENTS:
+            for user_id in chat_participants(record.get("chat_id", "")):
+                if kind != "message_status" or user_id != record["user_id"]:
+                    delivered[user_id] = delivered.get(user_id, 0) + 1
+    for group_id, count in group_messages.items():
+        for user_id in membership.members_of(group_id):
+            delivered[user_id] = delivered.get(user_id, 0) + count
+    for user_id, count in delivered.items():
+        if user_id in users:
+            deliveries.advance(user_id, count)
+    if records:
+        count = sum(len(history) for store in (messages, private_chats) for history in store.conversations.values())
+        print(f"Restored {len(users)} users, {len(groups)} groups and {count} messages from {journal.path} "
+              f"({records} records) in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+# Nodes announce themselves every NODE_HEARTBEAT_INTERVAL. The users present
+# on a node not heard from for NODE_TIMEOUT (one that died without draining)
+# are taken offline, and freed after the reconnect grace period as usual.
+NODE_HEARTBEAT_INTERVAL = float(os.environ.get("NODE_HEARTBEAT_INTERVAL", 5))
+NODE_TIMEOUT = float(os.environ.get("NODE_TIMEOUT", 30))
+node_seen: Dict[str, float] = {}  # peer node_id -> when an event from it last arrived
+node_watcher: Optional[asyncio.Task] = None
+
+async def watch_nodes():
+    heartbeat = {"type": "node_heartbeat"}
+    frame = dumps(heartbeat)
+    while True:
+        await asyncio.sleep(NODE_HEARTBEAT_INTERVAL)
+        await backplane.publish(heartbeat, frame)
+        now = time.monotonic()
+        for node_id in [node_id for node_id, seen in node_seen.items() if now - seen > NODE_TIMEOUT]:
+            del node_seen[node_id]
+            expire_node(node_id)
+
+def expire_node(node_id: str):
+    # Every peer sees the same silence, so each drops the presence on its own;
+    # the user_removed they publish after the grace period is idempotent
+    stranded = [user_id for user_id, owner in presence.items() if owner == node_id]
+    if stranded:
+        print(f"Node {node_id} went silent; taking its {len(stranded)} users offline")
+    for user_id in stranded:
+        del presence[user_id]
+        presence_digests.update(user_id)
+        if user_id not in departures and user_id in users:
+            departures[user_id] = asyncio.create_task(remove_after_grace(user_id))
+
+async def handle_event(node_id: str, event: dict, frame: bytes):
+    kind = event["type"]
+    if node_id != backplane.node_id:
+        node_seen[node_id] = time.monotonic()
+    if kind == "node_heartbeat":
+        return
+    # Every synced peer claims a state request; only the first claim through
+    # the backplane is answered, on the requester's own channel, so one node
+    # encodes the snapshot and one decodes it
+    if kind == "state_request":
+        if node_id != backplane.node_id and state_synced.is_set():
+            claim = {"type": "state_claim", "to": node_id, "request": event["id"]}
+            await backplane.publish(claim, dumps(claim))
+        return
+    if kind == "state_claim":
+        if event["request"] in state_claims:
+            return
+        state_claims[event["request"]] = node_id
+        if len(state_claims) > 1024:
+            del state_claims[next(iter(state_claims))]
+        if node_id == backplane.node_id:
+            reply = {"type": "state_snapshot", "request": event["request"], "state": state_snapshot()}
+            await backplane.publish_to(event["to"], reply, dumps(reply))
+        elif event["request"] == state_request_id and state_reply is not None and not state_reply.done():
+            sync_buffer.clear()  # everything before the claim is in the claimant's snapshot
+        return
+    if kind == "state_snapshot":
+        if event["request"] == state_request_id and state_reply is not None and not state_reply.done():
+            state_reply.set_result(event["state"])
+        return
+    
+    if not state_synced.is_set():
+        sync_buffer.append((node_id, event, frame))
+        return
+    await apply_received(node_id, event, frame)
+
+async def sync_state_from_peer(retry: bool) -> bool:
+    """Restore a peer's state; with `retry`, keep asking until one answers or STATE_SYNC_DEADLINE passes.
+
+    Each attempt is a new request, so a claim or snapshot for one that
+    already timed out is ignored rather than mixed into the next.
+    """
+    global state_reply, state_request_id
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STATE_SYNC_DEADLINE
+    while True:
+        state_reply = loop.create_future()
+        state_request_id = generate_id()
+        request = {"type": "state_request", "id": state_request_id}
+        await backplane.publish(request, dumps(request))
+        try:
+            restore_state(await asyncio.wait_for(state_reply, STATE_SYNC_TIMEOUT))
+            print(f"Restored state from a peer: {len(users)} users, {len(groups)} groups")
+            return True
+        except asyncio.TimeoutError:
+            if not retry or loop.time() >= deadline:
+                return False
+
+async def finish_state_sync():
+    """Apply the events held back while waiting for a peer's state, then stop holding them."""
+    while sync_buffer:
+        await apply_received(*sync_buffer.popleft())
+    state_synced.set()
+
+async def apply_received(node_id: str, event: dict, frame: bytes):
+    kind = event["type"]
+    if kind == "user_created" and not claim_username(event["user"]):
+        if node_id == backplane.node_id:
+            # Lost the name to a signup that reached the backplane first
+            await publish({"type": "user_removed", "user_id": event["user"]["id"], "groups": []})
+        return
+    if node_id != backplane.node_id:
+        apply_event(node_id, event)
+        if journal is not None and kind in JOURNALED_EVENTS:
+            journal.append(frame)
+    deliver_event(event, frame)
+
+async def publish(event: dict):
+    frame = dumps(event)
+    apply_event(backplane.node_id, event)
+    if journal is not None and event["type"] in JOURNALED_EVENTS:
+        journal.append(frame)
+    if persistence is not None:
+        rows = event_rows(event)
+        if rows:
+            await persistence.put(rows)
+    await backplane.publish(event, frame)
+
+backplane.subscribe(handle_event)
+
+typing_indicators = TypingCoalescer(publish)
+receipts = ReceiptCoalescer(publish)
+
+@app.on_event("startup")
+async def startup_event():
+    if persistence is not None:
+        create_tables()
+        persistence.start()
+    if isinstance(backplane, LocalBackplane):
+        state_synced.set()
+    await backplane.start()
+    
+    global loop_thread, emf_task
+    loop_thread = threading.get_ident()
+    loop_lag.start()
+    watchdog.start()
+    drain.install()
+    if metrics.METRICS_EMF_INTERVAL > 0:
+        emf_task = asyncio.create_task(metrics.emit_emf(emf_values))
+    
+    owns_journal = journal is not None and journal.acquire()
+    if journal is not None and not owns_journal:
+        print(f"State journal {journal.path} is owned by another process; not snapshotting")
+    
+    from_peer = False
+    if not state_synced.is_set():
+        # On a cold start the journal's owner finds no synced peer and restores
+        # from disk; the other workers keep asking until it can answer them
+        from_peer = await sync_state_from_peer(retry=journal is not None and not owns_journal)
+        if not from_peer and journal is not None and not owns_journal:
+            print(f"No peer answered within {STATE_SYNC_DEADLINE:.0f}s; starting with empty state")
+    
+    if owns_journal:
+        if from_peer:
+            # A peer's state is newer than anything on disk
+            journal.start(journal_state)
+            await journal.compact()
+        else:
+            restore_journal()
+            journal.start(journal_state)
+            # Restored users get the reconnect grace period to come back
+            for user_id in users:
+                departures[user_id] = asyncio.create_task(remove_after_grace(user_id))
+    
+    await finish_state_sync()
+    
+    global node_watcher
+    if not isinstance(backplane, LocalBackplane):
+        # Owners of presence restored from a peer or the journal get a full
+        # timeout to show they are alive
+        now = time.monotonic()
+        for node_id in set(presence.values()) - {backplane.node_id}:
+            node_seen.setdefault(node_id, now)
+        node_watcher = asyncio.create_task(watch_nodes())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    loop_lag.close()
+    watchdog.close()
+    drain.close()
+    for departure in departures.values():
+        departure.cancel()
+    if emf_task is not None:
+        emf_task.cancel()
+    if node_watcher is not None:
+        node_watcher.cancel()
+    await typing_indicators.close()
+    await presence_digests.close()
+    if journal is not None:
+        await journal.close()
+    await receipts.close()
+    await backplane.close()
+    if persistence is not None:
+        await persistence.close()
+        await async_engine.dispose()
+    if history_spill is not None:
+        await asyncio.get_running_loop().run_in_executor(None, history_spill.close)
+
+# Signups on this node not yet seen back from the backplane: user_id -> won the name
+signups: Dict[str, asyncio.Future] = {}
+SIGNUP_CONFIRM_TIMEOUT = float(os.environ.get("SIGNUP_CONFIRM_TIMEOUT", 2))
+
+def claim_username(user: dict) -> bool:
+    """Settle who owns a username, in backplane order, the same way on every node.
+
+    Two nodes (or workers) can each accept the same name before hearing of
+    the other's signup; the user_created that reaches the backplane first
+    keeps it. A signup still waiting for its own event to come back holds
+    the name only provisionally.
+    """
+    owner = usernames.get(user["username"].casefold())
+    won = owner is None or owner == user["id"] or owner in signups
+    signup = signups.pop(user["id"], None)
+    if signup is not None and not signup.done():
+        signup.set_result(won)
+    return won
+
+def validate_username(data: dict) -> str:
     username = data.get("username", "").strip()
     
     if not username or len(username) < 2 or len(username) > 20:
         raise HTTPException(status_code=400, detail="Username must be 2-20 characters")
     
-    for user in users.values():
-        if user["username"].lower() == username.lower():
-            raise HTTPException(status_code=409, detail="Username already taken")
+    if username.casefold() in usernames:
+        raise HTTPException(status_code=409, detail="Username already taken")
+    
+    return username
+
+@app.post("/api/check-username")
+async def check_username(data: dict):
+    validate_username(data)
+    return {"available": True}
+
+@app.post("/api/create-user")
+async def create_user(data: dict):
+    # No await between the index check and publish() applying the new user,
+    # so concurrent signups on this node cannot both claim a name
+    username = validate_username(data)
     
     user_id = generate_id()
-    users[user_id] = {
-        "id": user_id,
-        "username": username,
-        "connected_at": datetime.utcnow().isoformat(),
-        "last_seen": datetime.utcnow().isoformat()
-    }
+    signup = signups[user_id] = asyncio.get_running_loop().create_future()
+    await publish({
+        "type": "user_created",
+        "user": {
+            "id": user_id,
+            "username": username,
+            "connected_at": utc_timestamp(),
+            "last_seen": utc_timestamp()
+        }
+    })
+    
+    # Another node may have taken the name at the same moment. If the broker
+    # is slow to echo the event back, the signup goes ahead and is undone
+    # with a user_removed should it turn out to have lost.
+    try:
+        if not await asyncio.wait_for(signup, SIGNUP_CONFIRM_TIMEOUT):
+            raise HTTPException(status_code=409, detail="Username already taken")
+    except asyncio.TimeoutError:
+        pass
     
     return {"user_id": user_id, "username": username}
 
+def user_summary(user: dict) -> dict:
+    return {
+        "id": user["id"],
+        "username": user["username"],
+        "last_seen": user["last_seen"],
+        "is_typing": False,
+        "typing_in": None
+    }
+
+def group_summary(group: dict) -> dict:
+    return {
+        "id": group["id"],
+        "name": group["name"],
+        "description": group.get("description", ""),
+        "type": group["type"],
+        "member_count": membership.count(group["id"]),
+        "has_password": bool(group.get("password_hash")),
+        "created_at": group["created_at"]
+    }
+
+def list_online_users() -> list:
+    return [user_summary(user) for user in users.values() if user["id"] in presence]
+
+def list_groups() -> list:
+    group_list = [group_summary(group) for group in groups.values()]
+    return sorted(group_list, key=lambda x: x["created_at"], reverse=True)
+
+def online_summary(user_id: str) -> Optional[dict]:
+    user = users.get(user_id)
+    return user_summary(user) if user is not None and user_id in presence else None
+
+async def announce_presence(digest: dict):
+    """Send each local socket the part of a presence digest about its own contacts."""
+    changes = {summary["id"]: summary for summary in digest["online"]}
+    changes.update((user_id, None) for user_id in digest["offline"])
+    seen_by: Dict[str, list] = {}  # recipient -> changed user ids it may see
+    for user_id in changes:
+        for contact_id in membership.contacts_of(user_id):
+            if contact_id in connections:
+                seen_by.setdefault(contact_id, []).append(user_id)
+    
+    # Recipients with the same contacts among the changes share one frame
+    audiences: Dict[tuple, list] = {}
+    for recipient_id, changed in seen_by.items():
+        audiences.setdefault(tuple(changed), []).append(recipient_id)
+    for changed, recipients in audiences.items():
+        broadcaster.broadcast({
+            "type": "presence",
+            "online": [changes[uid] for uid in changed if changes[uid] is not None],
+            "offline": [uid for uid in changed if changes[uid] is None]
+        }, recipients)
+
+# Groups are pushed to clients over /ws so they do not need to poll /api/groups.
+# Presence is pushed only to contacts; the full online list is polled, which
+# costs a 304 until the next digest moves its version.
+directory = Directory()
+presence_digests = PresenceCoalescer(announce_presence, online_summary)
+online_users_listing = CachedListing(presence_digests, list_online_users)
+groups_listing = CachedListing(directory, list_groups)
+directory_snapshots = SnapshotFrames(directory, groups_listing, pack)
+
+def send_directory(user_id: str, version: Optional[int] = None):
+    """Bring `user_id` up to date with the changes after `version`, or a snapshot."""
+    delta = directory.delta(version)
+    if delta is None:
+        broadcaster.send_encoded(user_id, "directory_snapshot", directory_snapshots.get)
+    else:
+        broadcaster.send(user_id, delta)
+
+def listing_response(listing: CachedListing, request: Request) -> Response:
+    etag, body = listing.get()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/api/users")
-async def get_online_users():
-    online_users = []
-    for user in users.values():
-        if user["id"] in connections:
-            online_users.append({
-                "id": user["id"],
-                "username": user["username"],
-                "last_seen": user["last_seen"],
-                "is_typing": False,
-                "typing_in": None
-            })
-    return online_users
+async def get_online_users(request: Request):
+    return listing_response(online_users_listing, request)
 
 @app.get("/api/groups")
-async def get_groups():
-    group_list = []
-    for group in groups.values():
-        group_list.append({
-            "id": group["id"],
-            "name": group["name"],
-            "description": group.get("description", ""),
-            "type": group["type"],
-            "member_count": len(group.get("members", [])),
-            "has_password": bool(group.get("password_hash")),
-            "created_at": group["created_at"]
-        })
-    return sorted(group_list, key=lambda x: x["created_at"], reverse=True)
+async def get_groups(request: Request):
+    return listing_response(groups_listing, request)
 
 @app.post("/api/create-group")
 async def create_group(data: dict):
@@ -754,27 +1439,30 @@ async def create_group(data: dict):
         raise HTTPException(status_code=400, detail="Group name must be 2-50 characters")
     
     group_id = generate_id()
-    groups[group_id] = {
+    group = {
         "id": group_id,
         "name": name,
         "description": description,
         "type": group_type,
         "password_hash": hash_password(password) if password else None,
         "creator_id": user_id,
-        "members": [user_id],
-        "created_at": datetime.utcnow().isoformat(),
-        "last_activity": datetime.utcnow().isoformat()
+        "created_at": utc_timestamp(),
+        "last_activity": utc_timestamp()
     }
     
     # Initialize group messages
-    messages[group_id] = [{
-        "id": generate_id(),
-        "sender_id": "system",
-        "sender_username": "System",
-        "content": f"{users[user_id]['username']} created the group",
-        "timestamp": datetime.utcnow().isoformat(),
-        "message_type": "system"
-    }]
+    await publish({
+        "type": "group_created",
+        "group": group,
+        "message": {
+            "id": generate_id(),
+            "sender_id": "system",
+            "sender_username": "System",
+            "content": f"{users[user_id]['username']} created the group",
+            "timestamp": utc_timestamp(),
+            "message_type": "system"
+        }
+    })
     
     return {"group_id": group_id}
 
@@ -792,7 +1480,7 @@ async def join_group(data: dict):
     
     group = groups[group_id]
     
-    if user_id in group.get("members", []):
+    if membership.is_member(group_id, user_id):
         return {"success": True, "message": "Already a member"}
     
     # Check password for private groups
@@ -800,163 +1488,266 @@ async def join_group(data: dict):
         if not password or hash_password(password) != group["password_hash"]:
             raise HTTPException(status_code=403, detail="Incorrect password")
     
-    group["members"].append(user_id)
-    
-    # Add system message
-    if group_id not in messages:
-        messages[group_id] = []
-    
-    messages[group_id].append({
-        "id": generate_id(),
-        "sender_id": "system",
-        "sender_username": "System",
-        "content": f"{users[user_id]['username']} joined the group",
-        "timestamp": datetime.utcnow().isoformat(),
-        "message_type": "system"
+    # Add member with a system message
+    await publish({
+        "type": "group_joined",
+        "group_id": group_id,
+        "user_id": user_id,
+        "message": {
+            "id": generate_id(),
+            "sender_id": "system",
+            "sender_username": "System",
+            "content": f"{users[user_id]['username']} joined the group",
+            "timestamp": utc_timestamp(),
+            "message_type": "system"
+        }
     })
     
     return {"success": True}
 
 @app.get("/api/group/{group_id}/messages")
-async def get_group_messages(group_id: str, user_id: str):
+async def get_group_messages(group_id: str, user_id: str, before: Optional[str] = None,
+                             after: Optional[str] = None, limit: int = 100):
     if user_id not in users:
         raise HTTPException(status_code=401, detail="Invalid user")
     
     if group_id not in groups:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    group = groups[group_id]
-    if user_id not in group.get("members", []):
+    if not membership.is_member(group_id, user_id):
         raise HTTPException(status_code=403, detail="Not a member")
     
-    return messages.get(group_id, [])[-100:]  # Last 100 messages
+    # Last 100 messages by default; before/after take a message id or timestamp
+    return await page_history(messages, group_id, before, after, limit, column="group_id")
 
 @app.get("/api/private-chat/{other_user_id}")
-async def get_private_chat(other_user_id: str, user_id: str):
+async def get_private_chat(other_user_id: str, user_id: str, before: Optional[str] = None,
+                           after: Optional[str] = None, limit: int = 50):
     if user_id not in users or other_user_id not in users:
         raise HTTPException(status_code=401, detail="Invalid user")
     
     chat_id = get_private_chat_id(user_id, other_user_id)
-    return private_chats.get(chat_id, [])[-50:]  # Last 50 messages
+    # Last 50 messages by default; before/after take a message id or timestamp
+    return await page_history(private_chats, chat_id, before, after, limit, column="private_chat_id")
+
+
+async def receive_frame(websocket: WebSocket) -> Optional[dict]:
+    """Next client frame: JSON text, or MessagePack bytes on the binary subprotocol.
 
+    None for a frame that does not decode to an object; it is skipped.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    try:
+        if message.get("bytes") is not None:
+            data = unpack(message["bytes"])
+        else:
+            data = loads(message["text"])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def send_allowed(user_id: str, message_data: dict) -> bool:
+    retry = user_sends.allow(user_id)
+    group_id = message_data.get("group_id")
+    # Only a member's message to a real group is charged to it, so outsiders
+    # can neither spend a group's budget nor create buckets for made-up ids
+    if (retry is None and message_data["type"] == "group_message"
+            and group_id in groups and membership.is_member(group_id, user_id)):
+        retry = group_sends.allow(group_id)
+    if retry is None:
+        return True
+    broadcaster.send(user_id, {
+        "type": "rate_limited",
+        "message_id": message_data.get("message_id"),
+        "retry_after": round(retry, 3)
+    })
+    return False
+
+async def handle_client_message(user_id: str, message_data: dict):
+    if message_data.get("type") == "private_message":
+        recipient_id = message_data.get("recipient_id")
+        content = message_data.get("content", "").strip()
+        message_id = message_data.get("message_id", generate_id())
+        
+        if content and recipient_id:
+            chat_id = get_private_chat_id(user_id, recipient_id)
+            
+            message = {
+                "id": message_id,
+                "sender_id": user_id,
+                "sender_username": users[user_id]["username"],
+                "content": content,
+                "timestamp": utc_timestamp(),
+                "message_type": "text"
+            }
+            
+            # Store and send to both users
+            await publish({
+                "type": "private_message",
+                "chat_id": chat_id,
+                "recipient_id": recipient_id,
+                "message": message
+            })
+    
+    elif message_data.get("type") in ("typing", "stop_typing"):
+        chat_type = message_data.get("chat_type")
+        chat_id = message_data.get("chat_id")
+        if (chat_type == "group" and membership.is_member(chat_id, user_id)) or \
+                (chat_type == "private" and user_id in chat_participants(chat_id or "")):
+            typing_indicators.update(chat_type, chat_id, user_id, users[user_id]["username"],
+                                     message_data["type"] == "typing")
+    
+    elif message_data.get("type") == "message_status":
+        chat_id = message_data.get("chat_id") or ""
+        status = message_data.get("status")
+        if status in ReceiptCoalescer.STATUSES and user_id in chat_participants(chat_id):
+            seq = private_chats.sequence(chat_id, message_data.get("message_id"))
+            if seq is not None:
+                receipts.update(chat_id, user_id, message_data["message_id"], status, seq)
+    
+    elif message_data.get("type") == "ack":
+        if isinstance(message_data.get("seq"), int):
+            deliveries.ack(user_id, message_data["seq"])
+    
+    elif message_data.get("type") == "end_session":
+        # Logout or page unload: free the username now rather than after the grace period
+        typing_indicators.forget(user_id)
+        await remove_user(user_id)
+    
+    elif message_data.get("type") == "directory_sync":
+        send_directory(user_id, message_data.get("version"))
+    
+    elif message_data.get("type") == "group_message":
+        group_id = message_data.get("group_id")
+        content = message_data.get("content", "").strip()
+        message_id = message_data.get("message_id", generate_id())
+        
+        if content and group_id in groups:
+            if membership.is_member(group_id, user_id):
+                message = {
+                    "id": message_id,
+                    "sender_id": user_id,
+                    "sender_username": users[user_id]["username"],
+                    "content": content,
+                    "timestamp": utc_timestamp(),
+                    "message_type": "text"
+                }
+                
+                # Store and send to all group members
+                await publish({
+                    "type": "group_message",
+                    "group_id": group_id,
+                    "message": message
+                })
+
+async def reject_socket(websocket: WebSocket, code: int, reason: str):
+    # Closing before the handshake completes reaches the client as an HTTP 403
+    # (close code 1006), so accept first for it to see `code`
+    await websocket.accept()
+    await websocket.close(code=code, reason=reason)
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     if user_id not in users:
-        await websocket.close(code=4001, reason="Invalid user")
+        await reject_socket(websocket, 4001, "Invalid user")
         return
     
-    await websocket.accept()
-    connections[user_id] = websocket
+    # A draining server sends clients elsewhere; 1012 is "Service Restart"
+    if drain.draining:
+        await reject_socket(websocket, SERVICE_RESTART_CLOSE_CODE, "Service restart")
+        return
+    
+    # Reconnect storms queue here instead of all landing on the loop at once;
+    # 1013 is "Try Again Later"
+    if not await admission.admit():
+        await reject_socket(websocket, 1013, "Server busy")
+        return
+    
+    # A reconnecting client names the last delivery sequence number it saw
+    last_seq = websocket.query_params.get("last_seq")
+    last_seq = int(last_seq) if last_seq and last_seq.isdigit() else None
+    
+    subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    outbox = broadcaster.attach(user_id, websocket, binary=subprotocol == MSGPACK_SUBPROTOCOL)
+    send_directory(user_id)
+    # No await since attach, so live events can only queue behind the replay
+    replay_missed(user_id, last_seq, limit=outbox.maxsize // 2)
     
     # Notify others user is online
-    for other_user_id, ws in connections.items():
-        if other_user_id != user_id:
-            try:
-                await ws.send_text(json.dumps({
-                    "type": "user_online",
-                    "user": {
-                        "id": user_id,
-                        "username": users[user_id]["username"]
-                    }
-                }))
-            except:
-                pass
+    await publish({
+        "type": "user_online",
+        "user": {
+            "id": user_id,
+            "username": users[user_id]["username"]
+        }
+    })
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            if message_data.get("type") == "private_message":
-                recipient_id = message_data.get("recipient_id")
-                content = message_data.get("content", "").strip()
-                message_id = message_data.get("message_id", generate_id())
-                
-                if content and recipient_id:
-                    chat_id = get_private_chat_id(user_id, recipient_id)
-                    
-                    # Store message
-                    if chat_id not in private_chats:
-                        private_chats[chat_id] = []
-                    
-                    message = {
-                        "id": message_id,
-                        "sender_id": user_id,
-                        "sender_username": users[user_id]["username"],
-                        "content": content,
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "message_type": "text"
-                    }
-                    
-                    private_chats[chat_id].append(message)
-                    
-                    # Send to both users
-                    message_payload = {
-                        "type": "private_message",
-                        "chat_id": chat_id,
-                        "message": message
-                    }
-                    
-                    await websocket.send_text(json.dumps(message_payload))
-                    if recipient_id in connections:
-                        await connections[recipient_id].send_text(json.dumps(message_payload))
-            
-            elif message_data.get("type") == "group_message":
-                group_id = message_data.get("group_id")
-                content = message_data.get("content", "").strip()
-                message_id = message_data.get("message_id", generate_id())
-                
-                if content and group_id in groups:
-                    group = groups[group_id]
-                    
-                    if user_id in group.get("members", []):
-                        # Store message
-                        if group_id not in messages:
-                            messages[group_id] = []
-                        
-                        message = {
-                            "id": message_id,
-                            "sender_id": user_id,
-                            "sender_username": users[user_id]["username"],
-                            "content": content,
-                            "timestamp": datetime.utcnow().isoformat(),
-                            "message_type": "text"
-                        }
-                        
-                        messages[group_id].append(message)
-                        
-                        # Send to all group members
-                        message_payload = {
-                            "type": "group_message",
-                            "group_id": group_id,
-                            "message": message
-                        }
-                        
-                        for member_id in group["members"]:
-                            if member_id in connections:
-                                await connections[member_id].send_text(json.dumps(message_payload))
+            message_data = await receive_frame(websocket)
+            if message_data is None:
+                metrics.MESSAGES_IN.labels("invalid").inc()
+                continue
+            kind = message_data.get("type")
+            kind = kind if kind in CLIENT_MESSAGE_TYPES else "other"
+            metrics.MESSAGES_IN.labels(kind).inc()
+            if kind in RATE_LIMITED_TYPES and not send_allowed(user_id, message_data):
+                continue
+            with watchdog.handling(kind):
+                await handle_client_message(user_id, message_data)
+            if user_id not in users:
+                break  # the session ended; nothing is left to serve on this socket
             
     except WebSocketDisconnect:
-        # Remove user completely when they disconnect
-        username = users[user_id]["username"] if user_id in users else "Unknown"
-        print(f"User {username} disconnected - freeing username")
-        
-        # Remove user and free up username
-        if user_id in users:
-            del users[user_id]
-        if user_id in connections:
-            del connections[user_id]
-        
-        # Notify others user is offline
-        for other_user_id, ws in connections.items():
+        pass
+    finally:
+        # Also reached when a handler raises, so the socket never outlives its loop
+        broadcaster.detach(user_id, websocket)
+        if user_id not in users:
             try:
-                await ws.send_text(json.dumps({
-                    "type": "user_offline",
-                    "user_id": user_id
-                }))
-            except:
-                pass
+                await websocket.close(code=1000, reason="Session ended")
+            except Exception:
+                pass  # already closed by the client
+        elif user_id not in connections:  # else replaced by a newer socket for the same user
+            await user_disconnected(user_id)
+
+async def user_disconnected(user_id: str):
+    username = users[user_id]["username"] if user_id in users else "Unknown"
+    print(f"User {username} disconnected")
+    
+    # Show the user offline now; keep them, their groups and their inbox
+    # through the grace period so a reconnect can resume
+    typing_indicators.forget(user_id)
+    await publish({
+        "type": "user_offline",
+        "user_id": user_id
+    })
+    if user_id not in departures and user_id in users:
+        departures[user_id] = asyncio.create_task(remove_after_grace(user_id))
+
+async def remove_after_grace(user_id: str):
+    await asyncio.sleep(RECONNECT_GRACE)
+    departures.pop(user_id, None)
+    if user_id in presence or user_id not in users:
+        return
+    
+    print(f"User {users[user_id]['username']} did not reconnect - freeing username")
+    await remove_user(user_id)
+
+async def remove_user(user_id: str):
+    # Remove user, free up username and leave their groups
+    departure = departures.pop(user_id, None)
+    if departure is not None and departure is not asyncio.current_task():
+        departure.cancel()
+    receipts.forget(user_id)
+    await publish({
+        "type": "user_removed",
+        "user_id": user_id,
+        "groups": sorted(membership.groups_for(user_id))
+    })
 
 @app.get("/")
 async def serve_frontend():
@@ -967,4 +1758,13 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    workers = int(os.environ.get("WORKERS", 1))
+    if workers > 1 and not os.environ.get("BACKPLANE_URL"):
+        # Workers keep their own copy of the state and replicate it through a
+        # broker on a Unix socket, just like separate nodes do
+        from broker import start_local_broker
+        os.environ["BACKPLANE_URL"] = start_local_broker()
+    # Compression costs CPU per frame and buys little on small binary frames
+    per_message_deflate = os.environ.get("UVICORN_WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=port, workers=workers,
+                ws_per_message_deflate=per_message_deflate)
\ No newline at end of file
@@ -0,0 +1,58 @@
+from typing import Dict, Set
+
+_EMPTY: frozenset = frozenset()
+
+
+class Membership:
+    """Group membership as sets, with a reverse user -> groups index.
+
+    Authorization checks on the message path are a single set lookup, and a
+    user's groups can be found without scanning every group. Private chat
+    partners are tracked alongside, so a user's contacts (everyone they
+    share a group or chat with) can be found the same way.
+    """
+
+    def __init__(self):
+        self.members: Dict[str, Set[str]] = {}  # group_id -> user_ids
+        self.groups_of: Dict[str, Set[str]] = {}  # user_id -> group_ids
+        self.peers: Dict[str, Set[str]] = {}  # user_id -> private chat partners
+
+    def add(self, group_id: str, user_id: str) -> bool:
+        members = self.members.setdefault(group_id, set())
+        if user_id in members:
+            return False
+        members.add(user_id)
+        self.groups_of.setdefault(user_id, set()).add(group_id)
+        return True
+
+    def remove_user(self, user_id: str) -> Set[str]:
+        groups = self.groups_of.pop(user_id, set())
+        for group_id in groups:
+            self.members[group_id].discard(user_id)
+        for peer_id in self.peers.pop(user_id, set()):
+            self.peers[peer_id].discard(user_id)
+        return groups
+
+    def add_peer(self, user_id: str, peer_id: str):
+        if user_id != peer_id:
+            self.peers.setdefault(user_id, set()).add(peer_id)
+            self.peers.setdefault(peer_id, set()).add(user_id)
+
+    def is_member(self, group_id: str, user_id: str) -> bool:
+        return user_id in self.members.get(group_id, _EMPTY)
+
+    def members_of(self, group_id: str) -> Set[str]:
+        return self.members.get(group_id, _EMPTY)
+
+    def groups_for(self, user_id: str) -> Set[str]:
+        return self.groups_of.get(user_id, _EMPTY)
+
+    def contacts_of(self, user_id: str) -> Set[str]:
+        contacts = set(self.peers.get(user_id, _EMPTY))
+        for group_id in self.groups_of.get(user_id, _EMPTY):
+            contacts.update(self.members[group_id])
+        contacts.discard(user_id)
+        return contacts
+
+    def count(self, group_id: str) -> int:
+        return len(self.members.get(group_id, _EMPTY))
@@ -0,0 +1,253 @@
+import asyncio
+import bisect
+import json
+import os
+import sys
+import time
+from collections import Counter as StackCounter
+from typing import Callable, Dict, List, Optional, Tuple
+
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.25))  # seconds between lag probes
+METRICS_EMF_INTERVAL = float(os.environ.get("METRICS_EMF_INTERVAL", 0))  # 0 disables CloudWatch EMF lines
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "ShadowChat")
+METRICS_SERVICE = os.environ.get("METRICS_SERVICE", "shadowchat")
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+registry: List["Metric"] = []
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = ['%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Prometheus metric family; `labels(...)` returns the child for one label set."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.children: Dict[Tuple, object] = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._child()
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(c.value)}" for k, c in self.children.items()]
+
+
+class Gauge(Metric):
+    """Gauge, or a counter/gauge read from `collect` at scrape time.
+
+    `collect` returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], object]] = None, kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self) -> List[str]:
+        if self.collect is None:
+            values = {k: c.value for k, c in self.children.items()}
+        else:
+            values = self.collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in values.items()]
+
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _child(self):
+        return _Histogram(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, h in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), h.counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(h.sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {h.count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+# Message path
+
+MESSAGES_IN = Counter("shadowchat_messages_in_total", "WebSocket frames received from clients", ("type",))
+MESSAGES_OUT = Counter("shadowchat_messages_out_total", "Frames queued to client sockets", ("type",))
+FANOUT_SIZE = Histogram("shadowchat_fanout_recipients", "Connected recipients per fan-out", buckets=SIZE_BUCKETS)
+SEND_SECONDS = Histogram("shadowchat_send_seconds", "Time to write one frame to a socket")
+DELIVERY_SECONDS = Histogram("shadowchat_delivery_seconds", "Time from queueing a frame to writing it")
+HTTP_SECONDS = Histogram("shadowchat_http_request_seconds", "HTTP request latency",
+                         ("method", "route", "status"))
+LOOP_LAG_SECONDS = Histogram("shadowchat_event_loop_lag_seconds", "Event loop scheduling delay")
+
+
+class LoopLagMonitor:
+    """Probes event loop lag: how late a sleep of `interval` wakes up.
+
+    `window_max` is the worst lag since it was last reset (by the EMF
+    emitter), `last` the most recent probe.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self.window_max = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last = lag
+            self.window_max = max(self.window_max, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+async def emit_emf(values: Callable[[], Dict[str, Tuple[float, str]]], interval: float = METRICS_EMF_INTERVAL):
+    """Print CloudWatch Embedded Metric Format lines every `interval` seconds.
+
+    With the awslogs driver these become CloudWatch metrics that ECS target
+    tracking can scale on. `values` returns {name: (value, unit)}.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        current = values()
+        line = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["ServiceName"]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in current.items()],
+                }],
+            },
+            "ServiceName": METRICS_SERVICE,
+        }
+        line.update({name: value for name, (value, _) in current.items()})
+        print(json.dumps(line), flush=True)
+
+
+def sample_stacks(thread_id: int, seconds: float, hz: float) -> str:
+    """Sampling profiler: collapsed stacks of `thread_id` (flamegraph.pl input).
+
+    Blocks for `seconds`; run it off the thread being sampled.
+    """
+    counts = StackCounter()
+    interval = 1.0 / hz
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if stack:
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
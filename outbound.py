@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from metrics import DELIVERY_SECONDS, SEND_SECONDS
+
+OUTBOX_SIZE = int(os.environ.get("OUTBOX_SIZE", 256))
+OUTBOX_POLICY = os.environ.get("OUTBOX_POLICY", "drop_oldest")  # drop_oldest, disconnect
+SEND_TIMEOUT = float(os.environ.get("SEND_TIMEOUT", 5))
+
+POLICIES = ("drop_oldest", "disconnect")
+
+# Close code sent to consumers evicted for falling behind (RFC 6455 "Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Outbox:
+    """Bounded outbound queue for one WebSocket, drained by its own writer task.
+
+    `put` never awaits, so a sender is never held up by a slow receiver. Frames
+    are pre-serialized, and shared by every recipient of a plain fan-out.
+    Sequenced events (messages and statuses) carry each recipient's own
+    delivery number, so each recipient holds its own copy of those: a queue
+    can hold up to `maxsize` full frames.
+
+    Frames are text, or bytes for a connection using a binary subprotocol.
+    Entries are `(frame, enqueued_at, sequenced)` tuples. Presence and typing
+    are already folded per window upstream, so nothing is merged here.
+
+    `drop_oldest` drops the oldest frame without a delivery sequence number.
+    Sequenced frames are never dropped: a client only notices a missing one
+    when a later one arrives, so once nothing else is left to drop the
+    consumer is disconnected instead, and resumes from its inbox.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        stats,
+        maxsize: int = OUTBOX_SIZE,
+        policy: str = OUTBOX_POLICY,
+        send_timeout: float = SEND_TIMEOUT,
+        binary: bool = False,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbox policy: {policy}")
+        self.websocket = websocket
+        self.stats = stats
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.binary = binary
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.closing: Optional[tuple] = None  # (code, reason) once finish() is called
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, frame, sequenced: bool = False) -> bool:
+        if self.closed or self.closing is not None:
+            return False
+
+        if len(self.queue) >= self.maxsize and not self._make_room():
+            return False
+
+        self.queue.append((frame, time.perf_counter(), sequenced))
+        self.ready.set()
+        return True
+
+    def _make_room(self) -> bool:
+        if self.policy == "drop_oldest":
+            for i, entry in enumerate(self.queue):
+                if not entry[2]:
+                    del self.queue[i]
+                    self.stats.dropped += 1
+                    return True
+
+        self.stats.evicted += 1
+        self.close(evict=True)
+        return False
+
+    async def _run(self):
+        send = self.websocket.send_bytes if self.binary else self.websocket.send_text
+        while not self.closed:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            frame, enqueued_at, _ = self.queue.popleft()
+            if frame is None:
+                # Everything queued before finish() has been sent
+                await self._close_socket(*self.closing)
+                self.close()
+                return
+
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(send(frame), self.send_timeout)
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                self.close(evict=True)
+            except Exception:
+                self.stats.failures += 1
+                self.close()
+            finally:
+                now = time.perf_counter()
+                self.stats.send_latency.record((now - start) * 1000)
+                self.stats.delivery_latency.record((now - enqueued_at) * 1000)
+                SEND_SECONDS.observe(now - start)
+                DELIVERY_SECONDS.observe(now - enqueued_at)
+
+    def close(self, evict: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.ready.set()
+
+        current = asyncio.current_task()
+        if self.task is not None and self.task is not current:
+            self.task.cancel()
+
+        if evict:
+            asyncio.create_task(self._close_socket())
+
+    def finish(self, code: int, reason: str):
+        """Close the socket with `code` once the frames already queued are sent."""
+        if self.closed or self.closing is not None:
+            return
+        self.closing = (code, reason)
+        self.queue.append((None, time.perf_counter(), False))
+        self.ready.set()
+
+    async def _close_socket(self, code: int = SLOW_CONSUMER_CLOSE_CODE, reason: str = "Slow consumer"):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), self.send_timeout)
+        except Exception:
+            pass
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from database import Group, GroupMember, Message, User, engine
+
+PERSIST_BATCH_SIZE = int(os.environ.get("PERSIST_BATCH_SIZE", 500))
+PERSIST_FLUSH_INTERVAL = float(os.environ.get("PERSIST_FLUSH_INTERVAL", 0.25))
+PERSIST_QUEUE_SIZE = int(os.environ.get("PERSIST_QUEUE_SIZE", 10000))
+PERSIST_RETRIES = 3
+
+# Batches are written parent tables first so foreign keys always resolve
+MODEL_ORDER = (User, Group, GroupMember, Message)
+
+# (model, values, op) where op is "insert" or "update" (keyed on values["id"])
+Row = Tuple[type, dict, str]
+
+
+def _ts(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def event_rows(event: dict) -> List[Row]:
+    """Database rows for a backplane event; empty for events that are not persisted."""
+    kind = event["type"]
+
+    if kind == "user_created":
+        user = event["user"]
+        return [(User, {
+            "id": user["id"],
+            "username": user["username"],
+            "connected_at": _ts(user["connected_at"]),
+            "last_seen": _ts(user["last_seen"]),
+            "is_active": True,
+        }, "insert")]
+
+    if kind == "user_offline":
+        return [(User, {"id": event["user_id"], "is_active": False, "last_seen": datetime.utcnow()}, "update")]
+
+    if kind == "group_created":
+        group = event["group"]
+        return [
+            (Group, {
+                "id": group["id"],
+                "name": group["name"],
+                "description": group["description"],
+                "type": group["type"],
+                "password_hash": group["password_hash"],
+                "creator_id": group["creator_id"],
+                "created_at": _ts(group["created_at"]),
+                "last_activity": _ts(group["last_activity"]),
+            }, "insert"),
+            (GroupMember, {"group_id": group["id"], "user_id": group["creator_id"]}, "insert"),
+            (Message, _message_row(event["message"], group_id=group["id"]), "insert"),
+        ]
+
+    if kind == "group_joined":
+        return [
+            (GroupMember, {"group_id": event["group_id"], "user_id": event["user_id"]}, "insert"),
+            (Message, _message_row(event["message"], group_id=event["group_id"]), "insert"),
+        ]
+
+    if kind == "group_message":
+        return [(Message, _message_row(event["message"], group_id=event["group_id"]), "insert")]
+
+    if kind == "private_message":
+        return [(Message, _message_row(event["message"], private_chat_id=event["chat_id"]), "insert")]
+
+    return []
+
+
+def _message_row(message: dict, group_id: Optional[str] = None, private_chat_id: Optional[str] = None) -> dict:
+    return {
+        "id": message["id"],
+        "sender_id": message["sender_id"],
+        "content": message["content"],
+        "timestamp": _ts(message["timestamp"]),
+        "message_type": message["message_type"],
+        "group_id": group_id,
+        "private_chat_id": private_chat_id,
+    }
+
+
+class WriteBehind:
+    """Write-behind pipeline for the ORM models.
+
+    `put` appends rows to an in-memory queue and returns futures that resolve
+    to True once the rows are committed, or False if the batch was given up
+    on (the durability ack); callers on the send path do not wait for them. A flusher task hands batches of up to
+    `batch_size` rows, or whatever arrived within `flush_interval`, to a
+    single worker thread that bulk-inserts them. The queue is bounded:
+    once `max_queue` rows are pending, `put` waits for a flush to free space.
+    """
+
+    def __init__(self, engine, batch_size: int = PERSIST_BATCH_SIZE,
+                 flush_interval: float = PERSIST_FLUSH_INTERVAL, max_queue: int = PERSIST_QUEUE_SIZE):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.pending: List[Tuple[Row, asyncio.Future]] = []
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind")
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        self.slots = asyncio.Semaphore(self.max_queue)
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.task = asyncio.create_task(self._run())
+
+    async def put(self, rows: List[Row]) -> List[asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for row in rows:
+            await self.slots.acquire()
+            future = loop.create_future()
+            self.pending.append((row, future))
+            futures.append(future)
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+        return futures
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            while self.pending:
+                await self.flush()
+            if self.closing:
+                return
+
+    async def flush(self):
+        batch = self.pending[:self.batch_size]
+        del self.pending[:self.batch_size]
+        if not batch:
+            return
+
+        loop = asyncio.get_running_loop()
+        error = None
+        rejected = set()
+        for attempt in range(PERSIST_RETRIES):
+            try:
+                start = time.perf_counter()
+                rejected = await loop.run_in_executor(self.executor, self._write, [row for row, _ in batch])
+                self.last_flush_ms = (time.perf_counter() - start) * 1000
+                error = None
+                break
+            except SQLAlchemyError as e:
+                error = e
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+        for _ in batch:
+            self.slots.release()
+        if error is not None:
+            self.failed += len(batch)
+            print(f"Write-behind batch of {len(batch)} rows failed: {error!r}")
+        else:
+            self.written += len(batch)
+            self.batches += 1
+
+        self.rejected += len(rejected)
+        for i, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(error is None and i not in rejected)
+
+    def _write(self, rows: List[Row]) -> Set[int]:
+        """Runs on the worker thread: one transaction, one executemany per model and op.
+
+        Returns the positions of rows that were rejected by the database.
+        """
+        rejected = set()
+        with Session(self.engine) as session:
+            try:
+                with session.begin():
+                    self._execute(session, rows)
+            except IntegrityError:
+                # A duplicate or dangling row poisons the whole batch; retry row by row
+                # and drop just the offending ones
+                with session.begin():
+                    for i, row in enumerate(rows):
+                        try:
+                            with session.begin_nested():
+                                self._execute(session, [row])
+                        except IntegrityError:
+                            rejected.add(i)
+        return rejected
+
+    @staticmethod
+    def _execute(session: Session, rows: List[Row]):
+        for model in MODEL_ORDER:
+            inserts = [values for m, values, op in rows if m is model and op == "insert"]
+            if inserts:
+                session.execute(insert(model), inserts)
+            for m, values, op in rows:
+                if m is model and op == "update":
+                    changes = {k: v for k, v in values.items() if k != "id"}
+                    session.execute(update(model).where(model.id == values["id"]).values(**changes))
+
+    async def close(self):
+        self.closing = True
+        if self.task is not None:
+            self.wakeup.set()
+            await self.task
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.pending),
+            "written": self.written,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+        }
+
+
+def create_write_behind() -> Optional[WriteBehind]:
+    return WriteBehind(engine) if engine is not None else None
@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.sql import Select
+
+from codec import parse_timestamp
+from database import GroupMember, Message, User, async_session
+
+# (timestamp, id); id is None for a bare timestamp cursor
+Key = Tuple[datetime, Optional[str]]
+
+
+def cursor_statement(column, conversation_id: str, message_id: str) -> Select:
+    return select(Message.timestamp, Message.id).where(Message.id == message_id, column == conversation_id)
+
+
+def history_statement(column, conversation_id: str, before: Optional[Key] = None,
+                      after: Optional[Key] = None, limit: int = 50) -> Select:
+    """One page of a conversation in keyset order.
+
+    `column` is Message.group_id or Message.private_chat_id. Rows come back
+    newest first unless `after` is given, matching the
+    (conversation, timestamp, id) indexes so no page sorts or skips rows.
+    """
+    statement = (
+        select(Message.id, Message.sender_id, User.username, Message.content,
+               Message.timestamp, Message.message_type)
+        .join(User, User.id == Message.sender_id)
+        .where(column == conversation_id)
+    )
+    if before is not None:
+        timestamp, message_id = before
+        if message_id is None:
+            statement = statement.where(Message.timestamp < timestamp)
+        else:
+            statement = statement.where(tuple_(Message.timestamp, Message.id) < tuple_(timestamp, message_id))
+    if after is not None:
+        timestamp, message_id = after
+        if message_id is None:
+            statement = statement.where(Message.timestamp > timestamp)
+        else:
+            statement = statement.where(tuple_(Message.timestamp, Message.id) > tuple_(timestamp, message_id))
+
+    if after is not None:
+        order = (Message.timestamp, Message.id)
+    else:
+        order = (Message.timestamp.desc(), Message.id.desc())
+    return statement.order_by(*order).limit(limit)
+
+
+def membership_statement(group_id: str, user_id: str) -> Select:
+    return select(GroupMember.id).where(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
+
+
+def user_groups_statement(user_id: str) -> Select:
+    return select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+
+
+def _message(row) -> dict:
+    return {
+        "id": row.id,
+        "sender_id": row.sender_id,
+        "sender_username": row.username,
+        "content": row.content,
+        "timestamp": row.timestamp.isoformat(),
+        "message_type": row.message_type,
+    }
+
+
+async def _key(session, column, conversation_id: str, cursor: Optional[str]) -> Optional[Key]:
+    if cursor is None:
+        return None
+    row = (await session.execute(cursor_statement(column, conversation_id, cursor))).first()
+    if row is not None:
+        return row.timestamp, row.id
+    try:
+        return parse_timestamp(cursor), None
+    except ValueError:
+        raise KeyError(cursor)
+
+
+async def history_page(column: str, conversation_id: str, before: Optional[str] = None,
+                       after: Optional[str] = None, limit: int = 50) -> List[dict]:
+    """Same contract as HistoryStore.page, served from the read replica (or primary).
+
+    `column` is "group_id" or "private_chat_id".
+    """
+    column = getattr(Message, column)
+    async with async_session(read_only=True) as session:
+        before_key = await _key(session, column, conversation_id, before)
+        after_key = await _key(session, column, conversation_id, after)
+        rows = (await session.execute(history_statement(column, conversation_id, before_key, after_key, limit))).all()
+    if after is None:
+        rows.reverse()
+    return [_message(row) for row in rows]
+
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from metrics import Counter, Gauge, Histogram
+
+# WebSocket accepts per second across the process; a reconnect storm queues behind this
+ACCEPT_RATE = float(os.environ.get("ACCEPT_RATE", 200))
+ACCEPT_BURST = int(os.environ.get("ACCEPT_BURST", 100))
+ACCEPT_MAX_WAIT = float(os.environ.get("ACCEPT_MAX_WAIT", 10))  # seconds before a connect is turned away
+
+# Messages per second per user and per group, and REST calls per second per user (or address)
+USER_SEND_RATE = float(os.environ.get("USER_SEND_RATE", 5))
+USER_SEND_BURST = int(os.environ.get("USER_SEND_BURST", 20))
+GROUP_SEND_RATE = float(os.environ.get("GROUP_SEND_RATE", 50))
+GROUP_SEND_BURST = int(os.environ.get("GROUP_SEND_BURST", 100))
+REST_RATE = float(os.environ.get("REST_RATE", 10))
+REST_BURST = int(os.environ.get("REST_BURST", 30))
+
+ADMISSIONS = Counter("shadowchat_admissions_total", "WebSocket connects admitted or turned away", ("result",))
+ADMISSION_WAIT_SECONDS = Histogram("shadowchat_admission_wait_seconds", "Time a connect waited for admission",
+                                   buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+RATE_LIMITED = Counter("shadowchat_rate_limited_total", "Requests and messages refused by a token bucket",
+                       ("scope",))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def reserve(self, now: float) -> float:
+        """Take a token even if it is not there yet; returns how long to wait for it."""
+        self.refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def retry_after(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """A token bucket per key (user, group, address), created on first use.
+
+    Buckets that have refilled completely are indistinguishable from new
+    ones, so they are pruned now and then to keep idle keys from piling up.
+    """
+
+    PRUNE_EVERY = 4096
+
+    def __init__(self, scope: str, rate: float, burst: int):
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.created = 0
+        self.limited = RATE_LIMITED.labels(scope)
+
+    def allow(self, key: str) -> Optional[float]:
+        """None if `key` may go ahead, otherwise seconds until it may retry."""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+            self.created += 1
+            if self.created % self.PRUNE_EVERY == 0:
+                self.prune(now)
+        if bucket.take(now):
+            return None
+        self.limited.inc()
+        return bucket.retry_after()
+
+    def prune(self, now: float):
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[key]
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "keys": len(self.buckets), "limited": self.limited.value}
+
+
+class AdmissionController:
+    """Paces WebSocket accepts so a reconnect storm is spread out over time.
+
+    Each connect reserves the next slot of a token bucket and sleeps until
+    it comes up. A connect that would wait longer than `max_wait` is turned
+    away instead, and should retry later.
+    """
+
+    def __init__(self, rate: float = ACCEPT_RATE, burst: int = ACCEPT_BURST, max_wait: float = ACCEPT_MAX_WAIT):
+        self.bucket = TokenBucket(rate, burst, time.monotonic())
+        self.max_wait = max_wait
+        self.waiting = 0
+        Gauge("shadowchat_admission_waiting", "WebSocket connects waiting for admission",
+              collect=lambda: self.waiting)
+
+    async def admit(self) -> bool:
+        delay = self.bucket.reserve(time.monotonic())
+        if delay > self.max_wait:
+            self.bucket.tokens += 1
+            ADMISSIONS.labels("rejected").inc()
+            return False
+        if delay:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.waiting -= 1
+        ADMISSION_WAIT_SECONDS.observe(delay)
+        ADMISSIONS.labels("admitted").inc()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.bucket.rate,
+            "burst": self.bucket.burst,
+            "waiting": self.waiting,
+            "admitted": ADMISSIONS.labels("admitted").value,
+            "rejected": ADMISSIONS.labels("rejected").value,
+        }
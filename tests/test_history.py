@@ -0,0 +1,88 @@
+import pytest
+
+from history import History, HistoryStore, MessageRecord
+
+
+def message(n: int) -> MessageRecord:
+    return MessageRecord(f"m{n}", "alice", "alice", f"text {n}", f"2026-01-01T00:00:{n:02d}.000000")
+
+
+def ids(records) -> list:
+    return [record.id for record in records]
+
+
+def filled(count: int, capacity: int = 5) -> History:
+    history = History(capacity)
+    for n in range(count):
+        history.append(message(n))
+    return history
+
+
+def test_ring_buffer_keeps_the_latest_records():
+    history = History(3)
+    evicted = [history.append(message(n)) for n in range(5)]
+    assert ids(history) == ["m2", "m3", "m4"]
+    assert [e.id if e else None for e in evicted] == [None, None, None, "m0", "m1"]
+    assert history[0].id == "m2" and history[-1].id == "m4"
+    assert "m0" not in history.index
+
+
+def test_latest_page():
+    history = filled(8)
+    assert ids(history.page(limit=2)) == ["m6", "m7"]
+    assert ids(history.page(limit=50)) == ["m3", "m4", "m5", "m6", "m7"]
+
+
+def test_page_before_and_after_a_message():
+    history = filled(8)
+    assert ids(history.page(before="m6", limit=2)) == ["m4", "m5"]
+    assert ids(history.page(after="m4", limit=2)) == ["m5", "m6"]
+    assert ids(history.page(after="m4", before="m7")) == ["m5", "m6"]
+
+
+@pytest.mark.parametrize("cursor", [
+    "2026-01-01T00:00:05",
+    "2026-01-01T00:00:05.000000",
+    "2026-01-01T00:00:05Z",
+    "2026-01-01T02:00:05+02:00",
+])
+def test_timestamp_cursors(cursor):
+    history = filled(8)
+    assert ids(history.page(after=cursor)) == ["m6", "m7"]
+    assert ids(history.page(before=cursor)) == ["m3", "m4"]
+
+
+def test_unknown_or_evicted_cursor():
+    with pytest.raises(KeyError):
+        filled(3).page(after="no such message")
+    with pytest.raises(KeyError):
+        filled(8).page(before="m0")
+
+
+def test_covers():
+    history = filled(3)
+    assert history.covers(3, None, 50)  # nothing evicted yet
+    history = filled(8)
+    assert not history.covers(5, None, 50)  # older records were evicted
+    assert history.covers(2, None, 2)
+    assert history.covers(2, "m5", 50)
+    assert not history.covers(5, "2026-01-01T00:00:01", 50)  # starts among evicted records
+
+
+def test_store_spills_evicted_records():
+    spilled = []
+    store = HistoryStore(capacity=2, spill=lambda cid, record: spilled.append((cid, record.id)))
+    for n in range(4):
+        store.append("group", message(n))
+    store.append("other", message(9))
+    assert spilled == [("group", "m0"), ("group", "m1")]
+    assert [m["id"] for m in store.page("group")] == ["m2", "m3"]
+    assert store.sequence("group", "m3") == 3
+    assert store.sequence("group", "m0") is None
+    assert store.page("missing") == []
+    assert not store.covers("missing", 0, None, 50)
+
+
+def test_record_round_trip():
+    record = message(1)
+    assert MessageRecord.from_dict(record.to_dict()).to_dict() == record.to_dict()
@@ -0,0 +1,93 @@
+from inbox import DeliveryLog
+
+
+def fill(log: DeliveryLog, user_id: str, count: int) -> list:
+    return [log.record(user_id, {"type": "private_message", "n": n}, f"frame{n}") for n in range(count)]
+
+
+def test_sequence_numbers_are_per_user():
+    log = DeliveryLog()
+    assert fill(log, "alice", 3) == [1, 2, 3]
+    assert fill(log, "bob", 1) == [1]
+    assert log.latest("alice") == 3
+    assert log.latest("carol") == 0
+
+
+def test_since_returns_what_was_missed():
+    log = DeliveryLog()
+    fill(log, "alice", 5)
+    missed, complete = log.since("alice", 2)
+    assert complete
+    assert [seq for seq, _, _ in missed] == [3, 4, 5]
+    assert [frame for _, _, frame in missed] == ["frame2", "frame3", "frame4"]
+
+
+def test_nothing_missed():
+    log = DeliveryLog()
+    fill(log, "alice", 2)
+    assert log.since("alice", 2) == ([], True)
+    assert log.since("nobody", 0) == ([], True)
+
+
+def test_acked_events_are_not_replayed():
+    log = DeliveryLog()
+    fill(log, "alice", 5)
+    log.ack("alice", 3)
+    missed, complete = log.since("alice", 3)
+    assert complete and [seq for seq, _, _ in missed] == [4, 5]
+    # Resuming from before the ack is a gap
+    assert log.since("alice", 1) == ([], False)
+
+
+def test_events_pushed_out_of_the_inbox_are_a_gap():
+    log = DeliveryLog(size=3)
+    fill(log, "alice", 5)
+    assert log.since("alice", 1) == ([], False)
+    missed, complete = log.since("alice", 2)
+    assert complete and [seq for seq, _, _ in missed] == [3, 4, 5]
+
+
+def test_more_than_limit_is_not_replayed():
+    log = DeliveryLog()
+    fill(log, "alice", 10)
+    assert log.since("alice", 0, limit=5) == ([], False)
+    missed, complete = log.since("alice", 5, limit=5)
+    assert complete and len(missed) == 5
+
+
+def test_numbers_the_log_never_issued_are_a_gap():
+    log = DeliveryLog()
+    fill(log, "alice", 2)
+    assert log.since("alice", 7) == ([], False)
+    assert log.since("nobody", 3) == ([], False)
+
+
+def test_advance_counts_events_without_keeping_them():
+    log = DeliveryLog()
+    fill(log, "alice", 2)
+    log.advance("alice", 3)
+    assert log.latest("alice") == 5
+    assert log.since("alice", 2) == ([], False)
+    assert log.since("alice", 5) == ([], True)
+    assert log.record("alice", {"type": "group_message"}) == 6
+
+
+def test_snapshot_and_restore():
+    log = DeliveryLog()
+    fill(log, "alice", 3)
+    restored = DeliveryLog()
+    restored.restore(log.snapshot())
+    missed, complete = restored.since("alice", 1)
+    assert complete and [(seq, event["n"]) for seq, event, _ in missed] == [(2, 1), (3, 2)]
+
+    numbers_only = DeliveryLog()
+    numbers_only.restore(log.snapshot(events=False))
+    assert numbers_only.latest("alice") == 3
+    assert numbers_only.since("alice", 1) == ([], False)
+
+
+def test_forget():
+    log = DeliveryLog()
+    fill(log, "alice", 2)
+    log.forget("alice")
+    assert log.latest("alice") == 0
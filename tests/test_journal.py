@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from codec import dumps
+from journal import LENGTH, MAGIC, Journal
+
+
+def record(i: int) -> bytes:
+    return dumps({"type": "event", "i": i})
+
+
+def frame(payload: bytes) -> bytes:
+    return LENGTH.pack(len(payload)) + payload
+
+
+def append(path, count: int, first: int = 0):
+    """Load the journal at `path` like startup does, then append `count` events."""
+    async def run():
+        journal = Journal(str(path), fsync=False)
+        list(journal.load())
+        journal.start(lambda: {})
+        for i in range(first, first + count):
+            journal.append(record(i))
+        await journal.flush()
+        journal.task.cancel()
+        journal.file.close()
+    asyncio.run(run())
+
+
+def loaded(path) -> list:
+    return [r["i"] for r, _ in Journal(str(path)).load()]
+
+
+def test_missing_file_loads_nothing(tmp_path):
+    assert list(Journal(str(tmp_path / "none")).load()) == []
+
+
+def test_appended_records_load_in_order(tmp_path):
+    path = tmp_path / "journal"
+    append(path, 3)
+    append(path, 2, first=3)
+    assert loaded(path) == [0, 1, 2, 3, 4]
+
+
+def test_torn_tail_is_ignored_and_cut_off_before_appending(tmp_path):
+    path = tmp_path / "journal"
+    append(path, 2)
+    with open(path, "ab") as f:
+        f.write(frame(record(2))[:-3])
+    assert loaded(path) == [0, 1]
+    append(path, 2, first=2)
+    assert loaded(path) == [0, 1, 2, 3]
+
+
+def test_torn_first_record(tmp_path):
+    path = tmp_path / "journal"
+    path.write_bytes(MAGIC + LENGTH.pack(50) + b'{"type":')
+    assert loaded(path) == []
+    append(path, 3)
+    assert loaded(path) == [0, 1, 2]
+
+
+@pytest.mark.parametrize("header", [b"", MAGIC[:2], MAGIC])
+def test_empty_or_torn_header(tmp_path, header):
+    path = tmp_path / "journal"
+    path.write_bytes(header)
+    append(path, 2)
+    assert path.read_bytes().startswith(MAGIC)
+    assert loaded(path) == [0, 1]
+
+
+def test_undecodable_record_ends_the_load(tmp_path):
+    path = tmp_path / "journal"
+    path.write_bytes(MAGIC + frame(record(0)) + frame(b"not json") + frame(record(9)))
+    assert loaded(path) == [0]
+    append(path, 1, first=1)
+    assert loaded(path) == [0, 1]
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "journal"
+    path.write_bytes(b"something else entirely")
+    with pytest.raises(ValueError):
+        list(Journal(str(path)).load())
+
+
+def test_compaction_leaves_a_single_snapshot(tmp_path):
+    path = tmp_path / "journal"
+
+    async def run():
+        journal = Journal(str(path), fsync=False)
+        journal.start(lambda: {"users": ["alice"]})
+        for i in range(5):
+            journal.append(record(i))
+        await journal.flush()
+        journal.append(record(5))  # buffered events are part of the snapshot
+        await journal.close()
+    asyncio.run(run())
+
+    records = [r for r, _ in Journal(str(path)).load()]
+    assert records == [{"type": "state_snapshot", "state": {"users": ["alice"]}}]
+
+
+def test_only_one_owner(tmp_path):
+    path = str(tmp_path / "journal")
+    first, second = Journal(path), Journal(path)
+    assert first.acquire()
+    assert not second.acquire()
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from broadcast import Broadcaster
+from outbound import SLOW_CONSUMER_CLOSE_CODE, Outbox
+
+
+class FakeSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent = []
+        self.closed_with = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, frame):
+        await self.unblocked.wait()
+        self.sent.append(frame)
+
+    async def close(self, code, reason):
+        self.closed_with = code
+
+
+def queued(outbox: Outbox) -> list:
+    return [frame for frame, _, _ in outbox.queue]
+
+
+def run(test):
+    asyncio.run(test())
+
+
+def test_frames_are_sent_in_order():
+    async def test():
+        socket = FakeSocket()
+        outbox = Outbox(socket, Broadcaster({}))
+        outbox.start()
+        for frame in ("a", "b", "c"):
+            assert outbox.put(frame)
+        await asyncio.sleep(0.01)
+        assert socket.sent == ["a", "b", "c"]
+        outbox.close()
+    run(test)
+
+
+def test_drop_oldest_drops_unsequenced_frames_first():
+    async def test():
+        stats = Broadcaster({})
+        outbox = Outbox(FakeSocket(), stats, maxsize=3, policy="drop_oldest")
+        outbox.put("typing")
+        outbox.put("message 1", sequenced=True)
+        outbox.put("presence")
+        assert outbox.put("message 2", sequenced=True)
+        assert queued(outbox) == ["message 1", "presence", "message 2"]
+        assert outbox.put("message 3", sequenced=True)
+        assert queued(outbox) == ["message 1", "message 2", "message 3"]
+        assert stats.dropped == 2
+    run(test)
+
+
+def test_drop_oldest_disconnects_rather_than_drop_a_sequenced_frame():
+    async def test():
+        stats = Broadcaster({})
+        socket = FakeSocket()
+        outbox = Outbox(socket, stats, maxsize=2, policy="drop_oldest")
+        outbox.put("message 1", sequenced=True)
+        outbox.put("message 2", sequenced=True)
+        assert not outbox.put("presence")
+        assert outbox.closed and stats.evicted == 1
+        await asyncio.sleep(0.01)
+        assert socket.closed_with == SLOW_CONSUMER_CLOSE_CODE
+    run(test)
+
+
+def test_disconnect_policy_evicts_on_overflow():
+    async def test():
+        stats = Broadcaster({})
+        outbox = Outbox(FakeSocket(), stats, maxsize=1, policy="disconnect")
+        assert outbox.put("a")
+        assert not outbox.put("b")
+        assert outbox.closed and stats.evicted == 1 and stats.dropped == 0
+        assert not outbox.put("c")
+    run(test)
+
+
+def test_finish_sends_what_is_queued_then_closes():
+    async def test():
+        socket = FakeSocket(blocked=True)
+        outbox = Outbox(socket, Broadcaster({}))
+        outbox.start()
+        outbox.put("a")
+        outbox.put("b")
+        outbox.finish(1012, "Service restart")
+        assert not outbox.put("c")
+        socket.unblocked.set()
+        await asyncio.sleep(0.01)
+        assert socket.sent == ["a", "b"]
+        assert socket.closed_with == 1012
+        assert outbox.closed
+    run(test)
+
+
+def test_send_timeout_evicts_a_stuck_consumer():
+    async def test():
+        stats = Broadcaster({})
+        socket = FakeSocket(blocked=True)
+        outbox = Outbox(socket, stats, send_timeout=0.01)
+        outbox.start()
+        outbox.put("a")
+        await asyncio.sleep(0.05)
+        assert outbox.closed and stats.timeouts == 1
+        assert socket.closed_with == SLOW_CONSUMER_CLOSE_CODE
+    run(test)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Outbox(FakeSocket(), Broadcaster({}), policy="coalesce")
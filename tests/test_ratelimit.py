@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import ratelimit
+from ratelimit import AdmissionController, RateLimiter, TokenBucket
+
+
+def test_bucket_allows_a_burst_then_refills_at_rate():
+    bucket = TokenBucket(rate=2, burst=3, now=0)
+    assert [bucket.take(0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.retry_after() == pytest.approx(0.5)
+    assert not bucket.take(0.25)
+    assert bucket.take(0.5)
+
+
+def test_bucket_never_holds_more_than_burst():
+    bucket = TokenBucket(rate=10, burst=2, now=0)
+    bucket.refill(100)
+    assert bucket.tokens == 2
+
+
+def test_reserve_returns_the_wait_for_a_future_token():
+    bucket = TokenBucket(rate=4, burst=1, now=0)
+    assert bucket.reserve(0) == 0
+    assert bucket.reserve(0) == pytest.approx(0.25)
+    assert bucket.reserve(0) == pytest.approx(0.5)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_limiter_keeps_a_bucket_per_key(clock):
+    limiter = RateLimiter("test", rate=1, burst=2)
+    assert limiter.allow("a") is None
+    assert limiter.allow("a") is None
+    assert limiter.allow("a") == pytest.approx(1.0)
+    assert limiter.allow("b") is None
+    clock[0] += 1
+    assert limiter.allow("a") is None
+
+
+def test_limiter_prunes_full_buckets(clock):
+    limiter = RateLimiter("test", rate=1, burst=2)
+    limiter.allow("idle")
+    limiter.allow("busy")
+    limiter.allow("busy")
+    clock[0] += 1
+    limiter.prune(clock[0])
+    assert "idle" not in limiter.buckets
+    assert "busy" in limiter.buckets
+
+
+def test_admission_turns_away_connects_that_would_wait_too_long(clock):
+    admission = AdmissionController(rate=1, burst=1, max_wait=0)
+
+    async def run():
+        return [await admission.admit() for _ in range(2)]
+    assert asyncio.run(run()) == [True, False]
+    # A connect turned away gives its slot back
+    assert admission.bucket.tokens == 0
@@ -0,0 +1,39 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def receive_until(ws, kind: str) -> list:
+    frames = []
+    while True:
+        frames.append(json.loads(ws.receive_text()))
+        if frames[-1]["type"] == kind:
+            return frames
+
+
+def test_reconnect_replays_missed_messages():
+    with TestClient(main.app) as client:
+        alice = client.post("/api/create-user", json={"username": "replay_alice"}).json()["user_id"]
+        bob = client.post("/api/create-user", json={"username": "replay_bob"}).json()["user_id"]
+
+        with client.websocket_connect(f"/ws/{bob}") as ws:
+            assert receive_until(ws, "inbox_sync")[-1]["seq"] == 0
+
+        with client.websocket_connect(f"/ws/{alice}") as ws:
+            receive_until(ws, "inbox_sync")
+            for n in range(3):
+                ws.send_text(json.dumps({"type": "private_message", "recipient_id": bob, "content": f"m{n}"}))
+                receive_until(ws, "private_message")
+
+        with client.websocket_connect(f"/ws/{bob}?last_seq=1") as ws:
+            frames = receive_until(ws, "inbox_sync")
+        replayed = [frame for frame in frames if frame["type"] == "private_message"]
+        assert [(frame["seq"], frame["message"]["content"]) for frame in replayed] == [(2, "m1"), (3, "m2")]
+        assert frames[-1] == {"type": "inbox_sync", "seq": 3, "replayed": 2, "complete": True}
+
+        with client.websocket_connect(f"/ws/{bob}?last_seq=9") as ws:
+            frames = receive_until(ws, "inbox_sync")
+        assert frames[-1]["complete"] is False
+        assert not [frame for frame in frames if frame["type"] == "private_message"]
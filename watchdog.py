@@ -0,0 +1,119 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from metrics import Counter, Histogram
+
+WATCHDOG_THRESHOLD = float(os.environ.get("WATCHDOG_THRESHOLD", 0.1))  # seconds the loop may be blocked
+WATCHDOG_REPORTS = int(os.environ.get("WATCHDOG_REPORTS", 20))  # recent stalls kept for /debug/stalls
+
+STALLS = Counter("shadowchat_loop_stalls_total", "Event loop stalls longer than the watchdog threshold",
+                 ("handler",))
+STALL_SECONDS = Histogram("shadowchat_loop_stall_seconds", "Duration of event loop stalls",
+                          buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+HANDLER_SECONDS = Histogram("shadowchat_handler_seconds", "Wall time to handle one client frame, awaits included",
+                            ("type",))
+SLOW_HANDLERS = Counter("shadowchat_slow_handlers_total",
+                        "Client frames whose handler took longer than the threshold, awaits included", ("type",))
+
+
+class Watchdog:
+    """Detects a blocked event loop from outside it.
+
+    A task on the loop stamps a heartbeat every `threshold / 4`; a daemon
+    thread checks the stamp, and when it is older than `threshold` captures
+    the loop thread's stack once per stall, along with the client message
+    type the running task was handling. The stall is counted when the loop
+    comes back, with the duration observed.
+    """
+
+    def __init__(self, threshold: float = WATCHDOG_THRESHOLD, reports: int = WATCHDOG_REPORTS):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.beat = time.monotonic()
+        self.current: Dict[asyncio.Task, str] = {}  # task -> message type it is handling
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stalls = deque(maxlen=reports)
+        self.loop_thread: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.loop = asyncio.get_running_loop()
+        self.beat = time.monotonic()
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        report = None
+        while not self.stopping.wait(self.interval):
+            beat = self.beat
+            # The heartbeat itself sleeps for one interval between stamps
+            blocked = time.monotonic() - beat - self.interval
+            if blocked > self.threshold:
+                if report is None or report["beat"] != beat:
+                    frame = sys._current_frames().get(self.loop_thread)
+                    # The task holding the loop is the one asyncio has as running
+                    task = asyncio.current_task(self.loop)
+                    report = {
+                        "at": time.time(),
+                        "beat": beat,
+                        "handler": self.current.get(task, "unknown"),
+                        "stack": traceback.format_stack(frame) if frame is not None else [],
+                    }
+                    print(f"Event loop blocked for over {self.threshold * 1000:.0f} ms "
+                          f"(handling {report['handler']}):\n{''.join(report['stack'])}")
+                report["blocked_s"] = blocked
+            elif report is not None:
+                STALLS.labels(report["handler"]).inc()
+                STALL_SECONDS.observe(report["blocked_s"])
+                del report["beat"]
+                self.stalls.append(report)
+                report = None
+
+    @contextmanager
+    def handling(self, kind: str):
+        """Times one client frame's handler and marks it as its task's current one for stall reports.
+
+        Handlers interleave at their awaits, so the type is kept per task. The
+        time is wall time, including awaits such as backplane or write-behind
+        backpressure; the stall reports are what single out blocking code.
+        """
+        task = asyncio.current_task()
+        previous = self.current.get(task)
+        self.current[task] = kind
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if previous is None:
+                del self.current[task]
+            else:
+                self.current[task] = previous
+            HANDLER_SECONDS.labels(kind).observe(elapsed)
+            if elapsed > self.threshold:
+                SLOW_HANDLERS.labels(kind).inc()
+
+    def recent(self) -> list:
+        return [dict(report, blocked_ms=round(report["blocked_s"] * 1000, 1)) for report in self.stalls]